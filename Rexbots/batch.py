@@ -0,0 +1,235 @@
+# Rexbots
+# Don't Remove Credit
+# Telegram Channel @RexBots_Official
+
+import asyncio
+from collections import deque
+
+from config import BATCH_FREE_WORKERS, BATCH_PREMIUM_WORKERS, BATCH_GLOBAL_WORKERS, TRANSFER_PROCESSES
+from logger import LOGGER
+
+logger = LOGGER(__name__)
+
+# ==============================================================================
+# 📦 BATCH EXECUTOR
+# Keeps several messages of a range in flight per user, bounded by a global
+# cap across all users, while results are still delivered in range order.
+# ==============================================================================
+_global_slots = asyncio.Semaphore(max(1, BATCH_GLOBAL_WORKERS // TRANSFER_PROCESSES))  # This process's share
+
+PREFETCH_CHUNK = 200  # get_messages accepts up to 200 ids per call
+
+
+class BatchAborted(Exception):
+    """Raised by an item to stop scheduling the rest of the range (e.g. no session)."""
+
+
+def batch_workers(is_premium):
+    return BATCH_PREMIUM_WORKERS if is_premium else BATCH_FREE_WORKERS
+
+
+class OrderedDelivery(object):
+    """
+    Turnstile for range order: item `seq` may deliver once every earlier item
+    has either delivered or been skipped.
+    """
+
+    def __init__(self):
+        self._next = 0
+        self._finished = set()
+        self._cond = asyncio.Condition()
+
+    async def wait_turn(self, seq):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._next >= seq)
+
+    async def done(self, seq):
+        async with self._cond:
+            self._finished.add(seq)
+            while self._next in self._finished:
+                self._finished.discard(self._next)
+                self._next += 1
+            self._cond.notify_all()
+
+
+class MessageJob(object):
+    """
+    One message of a range; `msg` stays None when it wasn't prefetched.
+    Album members in the range are gathered into the first member's job.
+    """
+
+    def __init__(self, msgid, msg=None, msg_type=None):
+        self.msgid = msgid
+        self.msg = msg
+        self.msg_type = msg_type
+        self.media_group_id = getattr(msg, "media_group_id", None)
+        self.members = [self]
+
+    @property
+    def is_group(self):
+        return len(self.members) > 1
+
+    def add(self, job):
+        self.members.append(job)
+
+    def __repr__(self):
+        return f"MessageJob({self.msgid}, {self.msg_type})"
+
+
+class RangePrefetcher(object):
+    """
+    Async iterator of MessageJobs for a range of message ids.
+    Messages are fetched PREFETCH_CHUNK ids per get_messages call, with the
+    next chunk requested while the current one is still being worked off.
+    Empty, service and unsupported messages are dropped here, before any
+    work is scheduled for them. While `enabled()` is false (e.g. a public
+    range still served by copy_message) bare jobs are handed out instead.
+    """
+
+    def __init__(self, ids, get_client, chat_target, classify, limiter, enabled=None):
+        self.ids = list(ids)
+        self.get_client = get_client
+        self.chat_target = chat_target
+        self.classify = classify
+        self.limiter = limiter
+        self.enabled = enabled or (lambda: True)
+        self.dropped = 0
+        self._pos = 0
+        self._ready = deque()
+        self._fetch = None
+        self._taken = set()  # Album members already pulled in by an earlier chunk
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._ready:
+            if self._fetch is not None:
+                task, self._fetch = self._fetch, None
+                self._ready.extend(await task)
+            elif self._pos >= len(self.ids):
+                raise StopAsyncIteration
+            elif not self.enabled():
+                self._pos += 1
+                return MessageJob(self.ids[self._pos - 1])
+            else:
+                self._start_fetch()
+        job = self._ready.popleft()
+        # Keep the next chunk in flight while this one is worked off
+        if (self._fetch is None and self._pos < len(self.ids)
+                and len(self._ready) < PREFETCH_CHUNK // 2 and self.enabled()):
+            self._start_fetch()
+        return job
+
+    def _start_fetch(self):
+        chunk = self.ids[self._pos:self._pos + PREFETCH_CHUNK]
+        self._pos += len(chunk)
+        self._fetch = asyncio.create_task(self._load(chunk))
+
+    async def _load(self, chunk):
+        acc = await self.get_client()
+        try:
+            msgs = await self.limiter.call(self.chat_target, acc.get_messages, self.chat_target, chunk)
+        except Exception as e:
+            # Let the per-message path fetch (and report) them one by one
+            logger.warning(f"Prefetch of {chunk[0]}-{chunk[-1]} failed: {e}")
+            return [MessageJob(msgid) for msgid in chunk]
+        if not isinstance(msgs, list):
+            msgs = [msgs]
+        jobs = []
+        for msg in msgs:
+            if msg.id in self._taken:
+                continue
+            msg_type = None if (msg.empty or msg.service) else self.classify(msg)
+            if msg_type is None:
+                self.dropped += 1
+                continue
+            job = MessageJob(msg.id, msg, msg_type)
+            if job.media_group_id and jobs and jobs[-1].media_group_id == job.media_group_id:
+                jobs[-1].add(job)
+            else:
+                jobs.append(job)
+        # An album cut by the chunk boundary is completed here so it stays one job
+        if jobs and jobs[-1].media_group_id and chunk[-1] < self.ids[-1]:
+            await self._complete_album(acc, jobs[-1], chunk[-1])
+        return jobs
+
+    async def _complete_album(self, acc, job, last_id):
+        try:
+            album = await self.limiter.call(self.chat_target, acc.get_media_group, self.chat_target, job.msgid)
+        except Exception as e:
+            logger.warning(f"Could not complete album {job.media_group_id}: {e}")
+            return
+        for msg in album:
+            if last_id < msg.id <= self.ids[-1]:
+                msg_type = self.classify(msg)
+                if msg_type:
+                    job.add(MessageJob(msg.id, msg, msg_type))
+                    self._taken.add(msg.id)
+
+    def close(self):
+        if self._fetch is not None:
+            self._fetch.cancel()
+            self._fetch = None
+
+
+class BatchExecutor(object):
+    """
+    Runs handler(seq, item, delivery) for each item with at most `workers`
+    in flight. Items are started in order and every started item releases its
+    turn when it finishes, so later items never wait on a skipped one.
+    """
+
+    def __init__(self, workers, should_stop=None):
+        self.workers = max(1, workers)
+        self.should_stop = should_stop or (lambda: False)
+        self.delivery = OrderedDelivery()
+        self.aborted = False
+        self.stopped_early = False
+
+    async def _run_one(self, seq, item, handler, slots):
+        try:
+            await handler(seq, item, self.delivery)
+        except BatchAborted:
+            self.aborted = True
+        except Exception as e:
+            logger.error(f"Batch item {item} failed: {e}")
+        finally:
+            await self.delivery.done(seq)
+            slots.release()
+            _global_slots.release()
+
+    async def run(self, items, handler):
+        """`items` may be a plain or an async iterable (e.g. a RangePrefetcher)."""
+        slots = asyncio.Semaphore(self.workers)
+        tasks = []
+        seq = 0
+        try:
+            async for item in _aiter(items):
+                await slots.acquire()
+                await _global_slots.acquire()
+                if self.aborted or self.should_stop():
+                    slots.release()
+                    _global_slots.release()
+                    self.stopped_early = True
+                    break
+                tasks.append(asyncio.create_task(self._run_one(seq, item, handler, slots)))
+                seq += 1
+            await asyncio.gather(*tasks)
+        except BatchAborted:
+            self.aborted = True
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+
+async def _aiter(items):
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
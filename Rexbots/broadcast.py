@@ -6,34 +6,199 @@ from pyrogram.errors import InputUserDeactivated, UserNotParticipant, FloodWait,
 from database.db import db
 from pyrogram import Client, filters
 from pyrogram.types import Message
-from config import ADMINS
+from config import ADMINS, BROADCAST_WORKERS, BROADCAST_RATE
+from bson import ObjectId
+from Rexbots.export import export_users
+from Rexbots.ratelimit import TokenBucket, bot_limiter
+from Rexbots.scheduler import scheduler
+from Rexbots.staging import staging
 import asyncio
 import datetime
-import time
+import os
 from logger import LOGGER
 
 logger = LOGGER(__name__)
 
-async def broadcast_messages(user_id, message):
+# ==============================================================================
+# 📣 BROADCAST ENGINE
+# A bounded pool of senders sharing one token bucket, paced and FloodWait-gated
+# by the bot-wide rate limiter like every other send.
+# Jobs live in MongoDB with a cursor over users._id, so they survive restarts.
+# ==============================================================================
+DEAD_USERS_BATCH = 100   # Dead users removed per delete_many
+STATUS_INTERVAL = 10     # Seconds between progress edits
+JOB_BATCH = 200          # Users per checkpoint; at most this many are re-sent after a crash
+
+RUNNING_BROADCASTS = {}  # job_id -> BroadcastEngine
+
+USERS_USAGE = "**Usage:** `/users [premium|free] [banned|active] [since YYYY-MM-DD]`"
+
+
+async def broadcast_messages(bot, user_id, from_chat_id, message_id, bucket):
+    await bucket.acquire()
     try:
-        await message.copy(chat_id=user_id)
+        # A FloodWait pauses every sender of the bot, not just this one; the
+        # message is retried until it goes out, however long Telegram asks to wait
+        await bot_limiter.call_until_sent(user_id, bot.copy_message, chat_id=user_id, from_chat_id=from_chat_id, message_id=message_id)
         return True, "Success"
-    except FloodWait as e:
-        await asyncio.sleep(e.value)
-        return await broadcast_messages(user_id, message)
+    except FloodWait:
+        return False, "Error"
     except InputUserDeactivated:
-        await db.delete_user(int(user_id))
         return False, "Deleted"
     except UserIsBlocked:
-        await db.delete_user(int(user_id))
         return False, "Blocked"
     except PeerIdInvalid:
-        await db.delete_user(int(user_id))
-        return False, "Error"
+        return False, "Invalid"
     except Exception as e:
         logger.error(f"[!] Broadcast error for {user_id}: {e}")
         return False, "Error"
 
+
+class BroadcastEngine(object):
+    """
+    Runs one persisted broadcast job: copies the source message to users in
+    _id order with `workers` concurrent senders, capped globally at `rate`
+    messages per second, checkpointing the cursor and counters every batch.
+    """
+
+    COUNTERS = ('done', 'success', 'blocked', 'deleted', 'failed')
+
+    def __init__(self, bot, job, workers=BROADCAST_WORKERS, rate=BROADCAST_RATE):
+        self.bot = bot
+        self.job_id = job['_id']
+        self.job = job
+        self.cursor = job.get('cursor')
+        self.workers = workers
+        self.bucket = TokenBucket(rate)
+        self.cancelled = False
+        for name in self.COUNTERS:
+            setattr(self, name, job.get('counters', {}).get(name, 0))
+        self._dead = []
+
+    def counters(self):
+        return {name: getattr(self, name) for name in self.COUNTERS}
+
+    async def run(self):
+        reporter = asyncio.create_task(self._report_progress())
+        try:
+            while not self.cancelled:
+                batch = await db.get_users_after(self.cursor, JOB_BATCH)
+                if not batch:
+                    break
+                await self._send_batch(batch)
+                await self._flush_dead()
+                if self.cancelled:
+                    # Stop before checkpointing a batch that was cut short
+                    break
+                self.cursor = batch[-1]['_id']
+                if not await db.update_broadcast(self.job_id, self.cursor, self.counters()):
+                    # Cancelled from elsewhere (another process or a direct DB edit)
+                    self.cancelled = True
+        finally:
+            reporter.cancel()
+            await self._flush_dead()
+
+        state = "cancelled" if self.cancelled else "done"
+        await db.finish_broadcast(self.job_id, state, self.counters())
+        await self._edit_status(self._final_text(state))
+
+    async def _send_batch(self, batch):
+        queue = asyncio.Queue()
+        for user in batch:
+            queue.put_nowait(user.get('id'))
+        senders = [asyncio.create_task(self._sender(queue)) for _ in range(min(self.workers, len(batch)))]
+        try:
+            await asyncio.gather(*senders)
+        finally:
+            for task in senders:
+                task.cancel()
+
+    async def _sender(self, queue):
+        while not self.cancelled and not queue.empty():
+            await self._send(queue.get_nowait())
+
+    async def _send(self, user_id):
+        if not user_id:
+            self.done += 1
+            self.failed += 1
+            return
+        ok, reason = await broadcast_messages(
+            self.bot, int(user_id), self.job['from_chat_id'], self.job['message_id'], self.bucket
+        )
+        if ok:
+            self.success += 1
+        elif reason == "Blocked":
+            self.blocked += 1
+        elif reason == "Deleted":
+            self.deleted += 1
+        else:
+            self.failed += 1
+        if reason in ("Blocked", "Deleted", "Invalid"):
+            self._dead.append(int(user_id))
+            if len(self._dead) >= DEAD_USERS_BATCH:
+                await self._flush_dead()
+        self.done += 1
+
+    async def _flush_dead(self):
+        dead, self._dead = self._dead, []
+        if dead:
+            await db.delete_users(dead)
+
+    def status(self):
+        total_users = self.job.get('total', 0)
+        return (
+            f"**👥 Total Users:** {total_users}\n"
+            f"**💫 Completed:** {self.done} / {total_users}\n"
+            f"**✅ Success:** {self.success}\n"
+            f"**🚫 Blocked:** {self.blocked}\n"
+            f"**🚮 Deleted:** {self.deleted}"
+        )
+
+    def _final_text(self, state):
+        time_taken = datetime.datetime.now() - self.job['created_at']
+        title = "Broadcast Cancelled:" if state == "cancelled" else "Broadcast Completed:"
+        return (
+            f"**__{title}__**\n"
+            f"**⏰ Completed in:** {datetime.timedelta(seconds=int(time_taken.total_seconds()))}\n\n"
+            + self.status()
+        )
+
+    async def _edit_status(self, text):
+        try:
+            await self.bot.edit_message_text(self.job['status_chat_id'], self.job['status_message_id'], text)
+        except Exception:
+            pass
+
+    async def _report_progress(self):
+        last = None
+        while True:
+            await asyncio.sleep(STATUS_INTERVAL)
+            text = "**__Broadcast In Progress:__**\n\n" + self.status()
+            if text != last:
+                await self._edit_status(text)
+                last = text
+
+
+async def start_broadcast(bot, job):
+    engine = BroadcastEngine(bot, job)
+    RUNNING_BROADCASTS[job['_id']] = engine
+    try:
+        await engine.run()
+    except Exception as e:
+        logger.error(f"[!] Broadcast {job['_id']} stopped: {e}")
+    finally:
+        RUNNING_BROADCASTS.pop(job['_id'], None)
+
+
+async def resume_broadcasts(bot):
+    """Restarts every broadcast that was still running when the bot stopped."""
+    async for job in await db.get_running_broadcasts():
+        if job['_id'] in RUNNING_BROADCASTS:
+            continue
+        logger.info(f"Resuming broadcast {job['_id']} at {job.get('counters', {}).get('done', 0)}/{job.get('total', 0)}")
+        asyncio.create_task(start_broadcast(bot, job))
+
+
 @Client.on_message(filters.command("broadcast") & filters.user(ADMINS))
 async def broadcast_command(bot: Client, message: Message):
     b_msg = message.reply_to_message
@@ -43,72 +208,87 @@ async def broadcast_command(bot: Client, message: Message):
             quote=True
         )
 
-    users = await db.get_all_users()
     sts = await message.reply_text(
         text='**__Broadcasting your message...__**',
         quote=True
     )
 
-    start_time = time.time()
     total_users = await db.total_users_count()
-    done = 0
-    blocked = 0
-    deleted = 0
-    failed = 0
-    success = 0
-
-    async for user in users:
-        user_id = user.get('id')
-        if user_id:
-            pti, sh = await broadcast_messages(int(user_id), b_msg)
-            if pti:
-                success += 1
-            else:
-                if sh == "Blocked":
-                    blocked += 1
-                elif sh == "Deleted":
-                    deleted += 1
-                elif sh == "Error":
-                    failed += 1
-            done += 1
-            if done % 20 == 0:
-                await sts.edit(
-                    f"**__Broadcast In Progress:__**\n\n"
-                    f"**👥 Total Users:** {total_users}\n"
-                    f"**💫 Completed:** {done} / {total_users}\n"
-                    f"**✅ Success:** {success}\n"
-                    f"**🚫 Blocked:** {blocked}\n"
-                    f"**🚮 Deleted:** {deleted}"
-                )
-        else:
-            done += 1
-            failed += 1
-            if done % 20 == 0:
-                await sts.edit(
-                    f"**__Broadcast In Progress:__**\n\n"
-                    f"**👥 Total Users:** {total_users}\n"
-                    f"**💫 Completed:** {done} / {total_users}\n"
-                    f"**✅ Success:** {success}\n"
-                    f"**🚫 Blocked:** {blocked}\n"
-                    f"**🚮 Deleted:** {deleted}"
-                )
-
-    time_taken = datetime.timedelta(seconds=int(time.time() - start_time))
-    await sts.edit(
-        f"**__Broadcast Completed:__**\n"
-        f"**⏰ Completed in:** {time_taken}\n\n"
-        f"**👥 Total Users:** {total_users}\n"
-        f"**💫 Completed:** {done} / {total_users}\n"
-        f"**✅ Success:** {success}\n"
-        f"**🚫 Blocked:** {blocked}\n"
-        f"**🚮 Deleted:** {deleted}"
+    job = await db.create_broadcast(
+        from_chat_id=b_msg.chat.id,
+        message_id=b_msg.id,
+        status_chat_id=sts.chat.id,
+        status_message_id=sts.id,
+        total=total_users
     )
+    await start_broadcast(bot, job)
+
+
+@Client.on_message(filters.command("broadcast_status") & filters.user(ADMINS))
+async def broadcast_status(bot: Client, message: Message):
+    jobs = [job async for job in await db.get_running_broadcasts()]
+    if not jobs:
+        return await message.reply_text("**__No broadcast is running.__**", quote=True)
+
+    blocks = []
+    for job in jobs:
+        engine = RUNNING_BROADCASTS.get(job['_id'])
+        if engine is None:
+            # Persisted but not picked up by this process (yet)
+            engine = BroadcastEngine(bot, job)
+        blocks.append(f"**🆔 Job:** `{job['_id']}`\n" + engine.status())
+    await message.reply_text("**__Running Broadcasts:__**\n\n" + "\n\n".join(blocks), quote=True)
+
+
+@Client.on_message(filters.command("broadcast_cancel") & filters.user(ADMINS))
+async def broadcast_cancel(bot: Client, message: Message):
+    job_id = None
+    if len(message.command) > 1:
+        try:
+            job_id = ObjectId(message.command[1])
+        except Exception:
+            return await message.reply_text("**Usage:** `/broadcast_cancel [job_id]`", quote=True)
+
+    cancelled = await db.cancel_broadcasts(job_id)
+    for engine_id, engine in list(RUNNING_BROADCASTS.items()):
+        if job_id is None or engine_id == job_id:
+            engine.cancelled = True
+    if not cancelled:
+        return await message.reply_text("**__No matching broadcast is running.__**", quote=True)
+    await message.reply_text(f"**__Cancelled {cancelled} broadcast(s).__**", quote=True)
+
+def parse_export_filters(args):
+    """`/users` arguments as export_users() filters, or None if they don't parse."""
+    found = {}
+    args = [arg.lower() for arg in args]
+    while args:
+        arg = args.pop(0)
+        if arg in ("premium", "free") and 'premium' not in found:
+            found['premium'] = arg == "premium"
+        elif arg in ("banned", "active") and 'banned' not in found:
+            found['banned'] = arg == "banned"
+        elif arg == "since" and args and 'since' not in found:
+            try:
+                found['since'] = datetime.datetime.strptime(args.pop(0), "%Y-%m-%d")
+            except ValueError:
+                return None
+        else:
+            return None
+    return found
+
 
 @Client.on_message(filters.command("users") & filters.user(ADMINS))
 async def users_count(bot: Client, message: Message):
+    export_filters = parse_export_filters(message.command[1:])
+    if export_filters is None:
+        return await message.reply_text(USERS_USAGE, quote=True)
     msg = await message.reply_text("⏳ <b>__Gathering User Data...__</b>", quote=True)
     try:
         total = await db.total_users_count()
+        cache = db.cache_stats()
+        transfers = scheduler.stats()
+        limits = bot_limiter.state()
+        disk = staging.stats()
         await msg.edit_text(
             f"""
 🌀 <b><i>User Analytics Update</i></b> 🌀
@@ -116,32 +296,26 @@ async def users_count(bot: Client, message: Message):
 👥 <b>Total Registered Users:</b> {total}
 🛰 <b>System Status:</b> Active ✅
 🧠 <b>Data Source:</b> MongoDB (async)
+⚡ <b>User Cache:</b> {cache['hits']} hits / {cache['misses']} misses ({cache['size']} cached)
+⬇️ <b>Downloads:</b> {transfers['downloads']['active']}/{transfers['downloads']['capacity']} active, {transfers['downloads']['waiting']} queued
+⬆️ <b>Uploads:</b> {transfers['uploads']['active']}/{transfers['uploads']['capacity']} active, {transfers['uploads']['waiting']} queued
+🚦 <b>Send Rate:</b> {limits['rate']}/{limits['max_rate']:g} per sec, {limits['floods']} FloodWaits, paused {limits['wait']}s ({limits['chats_waiting']} chats waiting)
+💾 <b>Staging:</b> {disk['reserved'] / 1024 ** 3:.2f}/{(disk['budget'] or 0) / 1024 ** 3:.2f} GB reserved, {disk['waiting']} waiting
 """
         )
 
-        users_cursor = await db.get_all_users()
-        users_list = []
-        async for user in users_cursor:
-            users_list.append({
-                "name": user.get("name", "None"),
-                "username": user.get("username", "None"),
-                "id": user.get("id")
-            })
-
-        tmp_path = "SaveRestricted.json"
-        with open(tmp_path, "w", encoding="utf-8") as f:
-            json.dump(users_list, f, indent=2, ensure_ascii=False)
-
-        caption = f"📄 **Recorded {len(users_list)} Users**"
-        await message.reply_document(
-            document=tmp_path,
-            caption=caption
-        )
-
+        path, count = await export_users(**export_filters)
         try:
-            os.remove(tmp_path)
-        except Exception as e:
-            logger.error(f"[!] Failed to Delete File {tmp_path}: {e}")
+            await message.reply_document(
+                document=path,
+                file_name="users.ndjson.gz",
+                caption=f"📄 **Recorded {count} Users**" + (f" ({' '.join(message.command[1:])})" if export_filters else "")
+            )
+        finally:
+            try:
+                os.remove(path)
+            except Exception as e:
+                logger.error(f"[!] Failed to Delete File {path}: {e}")
 
     except Exception as e:
         await msg.edit_text(f"**__⚠️ Error Fetching User Data:__**\n<code>{e}</code>")
@@ -0,0 +1,185 @@
+# Rexbots
+# Don't Remove Credit
+# Telegram Channel @RexBots_Official
+
+import asyncio
+import time
+from collections import OrderedDict
+
+from config import API_ID, API_HASH, USER_POOL_SIZE, USER_IDLE_TIMEOUT
+from Rexbots.downloader import close_media_sessions
+from Rexbots.ratelimit import LimitedClient
+from logger import LOGGER
+
+logger = LOGGER(__name__)
+
+# ==============================================================================
+# 🔌 USER CLIENT POOL
+# One long-lived, connected user client per logged-in account.
+# ==============================================================================
+HEALTH_CHECK_INTERVAL = 120  # Seconds between get_me() probes on a reused client
+REAPER_INTERVAL = 60         # Seconds between idle-eviction sweeps
+
+
+class _PooledClient(object):
+    def __init__(self, client, session):
+        self.client = client
+        self.session = session
+        self.active = 0
+        self.last_used = time.monotonic()
+        self.last_check = time.monotonic()
+
+
+class UserClientPool(object):
+    """
+    Keeps user clients connected between messages so a range costs one
+    MTProto handshake instead of one per message.
+    Clients are evicted when idle, when the LRU cap is hit, when they fail
+    a health check, on /logout and on bot shutdown.
+    """
+
+    def __init__(self, max_clients=USER_POOL_SIZE, idle_timeout=USER_IDLE_TIMEOUT):
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self._clients = OrderedDict()  # user_id -> _PooledClient (LRU order)
+        self._locks = {}
+        self._reaper = None
+
+    def _lock(self, user_id):
+        if user_id not in self._locks:
+            self._locks[user_id] = asyncio.Lock()
+        return self._locks[user_id]
+
+    async def acquire(self, user_id, session_string):
+        """
+        Returns a connected client for the user, reusing the pooled one when
+        the session string is unchanged. Pair every call with release().
+        """
+        async with self._lock(user_id):
+            entry = self._clients.get(user_id)
+
+            if entry and entry.session != session_string:
+                await self._drop(user_id)
+                entry = None
+
+            if entry:
+                # Busy before the probe, so the reaper or another user's cap can't drop it meanwhile
+                entry.active += 1
+                if not await self._is_healthy(entry):
+                    logger.warning(f"Pooled client for {user_id} failed health check, reconnecting")
+                    await self._drop(user_id)
+                    entry = None
+
+            if entry is None:
+                entry = await self._connect(user_id, session_string)
+                entry.active += 1
+
+            self._clients.move_to_end(user_id)
+            entry.last_used = time.monotonic()
+
+        await self._enforce_cap()
+        self._ensure_reaper()
+        return entry.client
+
+    def release(self, user_id):
+        """Marks one use of the user's client as finished (keeps it connected)."""
+        entry = self._clients.get(user_id)
+        if entry:
+            entry.active = max(0, entry.active - 1)
+            entry.last_used = time.monotonic()
+
+    async def disconnect(self, user_id):
+        """Force-disconnects the user's client, e.g. on /logout."""
+        async with self._lock(user_id):
+            await self._drop(user_id)
+        self._locks.pop(user_id, None)
+
+    async def close_all(self):
+        """Disconnects every pooled client. Called on bot shutdown."""
+        if self._reaper and not self._reaper.done():
+            self._reaper.cancel()
+        self._reaper = None
+        for user_id in list(self._clients):
+            await self._drop(user_id)
+        self._locks.clear()
+        logger.info("User client pool closed")
+
+    def __len__(self):
+        return len(self._clients)
+
+    # --------------------------------------------------------
+    # Internals
+    # --------------------------------------------------------
+
+    async def _connect(self, user_id, session_string):
+        client = LimitedClient(
+            f"saverestricted_{user_id}",
+            session_string=session_string,
+            api_hash=API_HASH,
+            api_id=API_ID,
+            in_memory=True,
+            max_concurrent_transmissions=10  # High speed
+        )
+        await client.connect()
+        entry = _PooledClient(client, session_string)
+        self._clients[user_id] = entry
+        logger.info(f"User client connected for {user_id} (pool size: {len(self._clients)})")
+        return entry
+
+    async def _is_healthy(self, entry):
+        if not entry.client.is_connected:
+            return False
+        if time.monotonic() - entry.last_check < HEALTH_CHECK_INTERVAL:
+            return True
+        # Don't probe a client that is mid-transfer (besides the use being acquired), its traffic proves it alive
+        if entry.active > 1:
+            return True
+        try:
+            await asyncio.wait_for(entry.client.get_me(), timeout=15)
+        except Exception as e:
+            logger.warning(f"Health check failed: {e}")
+            return False
+        entry.last_check = time.monotonic()
+        return True
+
+    async def _drop(self, user_id):
+        entry = self._clients.pop(user_id, None)
+        if entry is None:
+            return
+        try:
+            await close_media_sessions(entry.client)
+            if entry.client.is_connected:
+                await entry.client.disconnect()
+        except Exception as e:
+            logger.warning(f"Failed to disconnect user client {user_id}: {e}")
+        logger.info(f"User client disconnected for {user_id}")
+
+    async def _enforce_cap(self):
+        # Evict least recently used idle clients; busy ones are never evicted
+        for user_id in list(self._clients):
+            if len(self._clients) <= self.max_clients:
+                break
+            entry = self._clients.get(user_id)
+            if entry and entry.active == 0:
+                await self._drop(user_id)
+
+    async def _evict_idle(self):
+        now = time.monotonic()
+        for user_id, entry in list(self._clients.items()):
+            if entry.active == 0 and now - entry.last_used > self.idle_timeout:
+                await self._drop(user_id)
+
+    def _ensure_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap())
+
+    async def _reap(self):
+        while self._clients:
+            await asyncio.sleep(REAPER_INTERVAL)
+            try:
+                await self._evict_idle()
+            except Exception as e:
+                logger.error(f"User client reaper error: {e}")
+
+
+user_pool = UserClientPool()
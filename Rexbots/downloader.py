@@ -0,0 +1,305 @@
+# Rexbots
+# Don't Remove Credit
+# Telegram Channel @RexBots_Official
+
+import asyncio
+import errno
+import math
+import os
+import weakref
+
+from pyrogram import raw
+from pyrogram.errors import FloodWait, FileReferenceExpired
+from pyrogram.file_id import FileId, FileType
+from pyrogram.session import Session, Auth
+from config import DOWNLOAD_CONNECTIONS
+from logger import LOGGER
+
+logger = LOGGER(__name__)
+
+# ==============================================================================
+# 🧵 PARALLEL CHUNKED DOWNLOADER
+# Splits a file into 1 MiB ranges and fetches them with several concurrent
+# upload.GetFile calls spread over multiple media sessions on the file's DC.
+# ==============================================================================
+CHUNK_SIZE = 1024 * 1024                # GetFile limit; offsets stay multiples of it
+PARALLEL_MIN_SIZE = 10 * 1024 * 1024    # Below this one connection is as fast
+PART_ATTEMPTS = 3                       # Tries per range before the download fails
+DOWNLOAD_RETRIES = 3                    # Resumes of an interrupted download before it fails
+RETRY_DELAY = 5                         # Seconds before the first resume, doubled each time
+
+PARALLEL_TYPES = ("Document", "Video", "Audio")
+
+# client -> {dc_id: [Session, ...]}, closed when the pooled user client is dropped
+_media_sessions = weakref.WeakKeyDictionary()
+_session_locks = weakref.WeakKeyDictionary()
+
+
+class ParallelUnsupported(Exception):
+    """The file can't be fetched by ranges (e.g. CDN-hosted); use download_media."""
+
+
+def can_download_parallel(msg_type, file_size):
+    return DOWNLOAD_CONNECTIONS > 1 and msg_type in PARALLEL_TYPES and file_size >= PARALLEL_MIN_SIZE
+
+
+async def _open_session(client, dc_id):
+    test_mode = await client.storage.test_mode()
+    if dc_id == await client.storage.dc_id():
+        session = Session(client, dc_id, await client.storage.auth_key(), test_mode, is_media=True)
+        await session.start()
+        return session
+
+    # Foreign DC: new auth key plus an imported authorization
+    session = Session(client, dc_id, await Auth(client, dc_id, test_mode).create(), test_mode, is_media=True)
+    await session.start()
+    try:
+        exported = await client.invoke(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+        await session.invoke(raw.functions.auth.ImportAuthorization(id=exported.id, bytes=exported.bytes))
+    except Exception:
+        await session.stop()
+        raise
+    return session
+
+
+async def get_media_sessions(client, dc_id, count):
+    """Returns `count` started media sessions for the client on `dc_id`, reusing open ones."""
+    if client not in _session_locks:
+        _session_locks[client] = asyncio.Lock()
+    async with _session_locks[client]:
+        sessions = _media_sessions.setdefault(client, {}).setdefault(dc_id, [])
+        while len(sessions) < count:
+            sessions.append(await _open_session(client, dc_id))
+        return sessions[:count]
+
+
+async def close_media_sessions(client):
+    """Stops every media session opened for the client."""
+    for sessions in _media_sessions.pop(client, {}).values():
+        for session in sessions:
+            try:
+                await session.stop()
+            except Exception as e:
+                logger.warning(f"Failed to stop media session: {e}")
+    _session_locks.pop(client, None)
+
+
+class PartLog(object):
+    """
+    Sidecar next to a partial download listing the ranges already written,
+    so a retry only fetches the missing ones.
+    """
+
+    def __init__(self, path):
+        self.path = f"{path}.parts"
+        self._f = None
+
+    def load(self, total_parts):
+        try:
+            with open(self.path) as f:
+                return {int(line) for line in f if line.strip().isdigit() and int(line) < total_parts}
+        except FileNotFoundError:
+            return set()
+
+    def add(self, index):
+        if self._f is None:
+            self._f = open(self.path, "a")
+        self._f.write(f"{index}\n")
+        self._f.flush()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ChunkedDownload(object):
+    """
+    One file fetched by ranges. stream() yields chunks in order,
+    to_file() writes ranges as they arrive.
+    """
+
+    def __init__(self, acc, msg, msg_type, limiter, connections=DOWNLOAD_CONNECTIONS):
+        self.acc = acc
+        self.limiter = limiter  # The user's RateLimiter, shared with their other calls
+        self.msg = msg
+        self.msg_type = msg_type
+        self.connections = max(1, connections)
+        self.file_size = getattr(msg, msg_type.lower()).file_size
+        self.total_parts = math.ceil(self.file_size / CHUNK_SIZE)
+        self._location = None
+        self._sessions = []
+
+    async def prepare(self):
+        file_id = FileId.decode(getattr(self.msg, self.msg_type.lower()).file_id)
+        if file_id.file_type == FileType.PHOTO:
+            raise ParallelUnsupported("Photos are small, use download_media")
+        self._location = raw.types.InputDocumentFileLocation(
+            id=file_id.media_id,
+            access_hash=file_id.access_hash,
+            file_reference=file_id.file_reference,
+            thumb_size=""
+        )
+        self._sessions = await get_media_sessions(self.acc, file_id.dc_id, self.connections)
+
+    async def _refresh_location(self):
+        # File references expire; a fresh copy of the message carries a new one
+        self.msg = await self.limiter.call(self.msg.chat.id, self.acc.get_messages, self.msg.chat.id, self.msg.id)
+        await self.prepare()
+
+    async def fetch(self, index):
+        """Fetches one range with per-part retries."""
+        session = self._sessions[index % len(self._sessions)]
+        for attempt in range(PART_ATTEMPTS):
+            try:
+                r = await session.invoke(raw.functions.upload.GetFile(
+                    location=self._location,
+                    offset=index * CHUNK_SIZE,
+                    limit=CHUNK_SIZE
+                ), sleep_threshold=0)
+            except FloodWait as e:
+                # Pauses every call of the account, not just this range
+                await self.limiter.wait_flood(e.value)
+                continue
+            except FileReferenceExpired:
+                await self._refresh_location()
+                session = self._sessions[index % len(self._sessions)]
+                continue
+            except (OSError, asyncio.TimeoutError) as e:
+                if attempt == PART_ATTEMPTS - 1:
+                    raise
+                logger.warning(f"Range {index} failed, retrying: {e}")
+                await asyncio.sleep(2 ** attempt)
+                continue
+            if not isinstance(r, raw.types.upload.File):
+                raise ParallelUnsupported("File is served from a CDN")
+            return r.bytes
+        raise ConnectionError(f"Range {index} failed after {PART_ATTEMPTS} attempts")
+
+    async def stream(self, start=0):
+        """Yields the file's chunks in order from chunk `start`, keeping up to 2 x connections ranges in flight."""
+        window = self.connections * 2
+        pending = {}
+        scheduled = start
+        try:
+            for index in range(start, self.total_parts):
+                while scheduled < self.total_parts and len(pending) < window:
+                    pending[scheduled] = asyncio.create_task(self.fetch(scheduled))
+                    scheduled += 1
+                yield await pending.pop(index)
+        finally:
+            for task in pending.values():
+                task.cancel()
+
+    def _part_size(self, index):
+        return min(CHUNK_SIZE, self.file_size - index * CHUNK_SIZE)
+
+    async def to_file(self, path, progress=None, progress_args=()):
+        """
+        Downloads into `path`, writing each range at its offset as soon as it
+        lands. Ranges logged by an earlier, interrupted call are kept.
+        """
+        log = PartLog(path)
+        finished = set()
+        if os.path.exists(path) and os.path.getsize(path) == self.file_size:
+            finished = log.load(self.total_parts)
+        if not finished:
+            log.remove()
+        queue = asyncio.Queue()
+        for index in range(self.total_parts):
+            if index not in finished:
+                queue.put_nowait(index)
+        done = {"bytes": sum(self._part_size(index) for index in finished)}
+
+        with open(path, "r+b" if finished else "wb") as f:
+            if not finished:
+                f.truncate(self.file_size)
+
+            async def worker():
+                while not queue.empty():
+                    index = queue.get_nowait()
+                    data = await self.fetch(index)
+                    f.seek(index * CHUNK_SIZE)
+                    f.write(data)
+                    # The range counts as done only once its bytes are out of our buffer
+                    f.flush()
+                    log.add(index)
+                    done["bytes"] += len(data)
+                    if progress:
+                        await progress(done["bytes"], self.file_size, *progress_args)
+
+            workers = [asyncio.create_task(worker()) for _ in range(min(self.connections, queue.qsize()))]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for task in workers:
+                    task.cancel()
+                log.close()
+        log.remove()
+        return path
+
+
+def resumable(error):
+    """Whether an interrupted transfer is worth resuming (not e.g. a full disk)."""
+    return isinstance(error, (OSError, asyncio.TimeoutError)) and getattr(error, "errno", None) != errno.ENOSPC
+
+
+async def download_parallel(acc, msg, msg_type, path, limiter, progress=None, progress_args=()):
+    """
+    Downloads `msg` into `path` over several connections. An interrupted
+    download is resumed from its part log up to DOWNLOAD_RETRIES times. Falls
+    back to the single-connection download_media when ranges aren't available.
+    """
+    download = ChunkedDownload(acc, msg, msg_type, limiter)
+    try:
+        await download.prepare()
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            try:
+                if attempt:
+                    await download.prepare()
+                return await download.to_file(path, progress, progress_args)
+            except (OSError, asyncio.TimeoutError) as e:
+                # Network blip or dropped session: resume from the last logged range
+                if attempt == DOWNLOAD_RETRIES or not resumable(e):
+                    raise
+                logger.warning(f"Download of {msg.id} interrupted ({e}), resuming ({attempt + 1}/{DOWNLOAD_RETRIES})")
+                await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
+    except ParallelUnsupported as e:
+        logger.info(f"Parallel download unavailable ({e}), using download_media")
+        PartLog(path).remove()
+        if os.path.exists(path):
+            os.remove(path)
+        return await acc.download_media(msg, file_name=path, progress=progress, progress_args=progress_args)
+
+
+async def iter_chunks(acc, msg, msg_type, limiter, offset=0):
+    """
+    Yields `msg`'s bytes in order from CHUNK_SIZE chunk `offset`, fetched over
+    several connections when possible, otherwise through the client's own
+    stream_media.
+    """
+    if DOWNLOAD_CONNECTIONS > 1 and msg_type in PARALLEL_TYPES:
+        download = ChunkedDownload(acc, msg, msg_type, limiter)
+        stream = None
+        try:
+            await download.prepare()
+            stream = download.stream(offset)
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            return
+        except ParallelUnsupported as e:
+            logger.info(f"Parallel stream unavailable ({e}), using stream_media")
+            if stream is not None:
+                await stream.aclose()
+        else:
+            yield first
+            async for chunk in stream:
+                yield chunk
+            return
+    async for chunk in acc.stream_media(msg, offset=offset):
+        yield chunk
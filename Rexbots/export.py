@@ -0,0 +1,77 @@
+# Rexbots
+# Don't Remove Credit
+# Telegram Channel @RexBots_Official
+
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+
+from database.db import db
+from logger import LOGGER
+
+logger = LOGGER(__name__)
+
+# ==============================================================================
+# 📤 USER EXPORT
+# Streams the users collection into a gzipped NDJSON file, one user per line.
+# The cursor is read batch by batch while a worker thread serialises and
+# compresses the previous batch, so memory stays flat and the loop free.
+# ==============================================================================
+EXPORT_BATCH = 1000  # Users per cursor batch and per write handed to the thread
+EXPORT_PROJECTION = {'_id': 1, 'id': 1, 'name': 1, 'username': 1, 'is_premium': 1, 'is_banned': 1}
+
+
+def _write_users(gz, users):
+    lines = []
+    for user in users:
+        lines.append(json.dumps({
+            "id": user.get("id"),
+            "name": user.get("name"),
+            "username": user.get("username"),
+            "premium": bool(user.get("is_premium")),
+            "banned": bool(user.get("is_banned")),
+            "joined": user["_id"].generation_time.isoformat(),
+        }, ensure_ascii=False))
+    gz.write(("\n".join(lines) + "\n").encode("utf-8"))
+
+
+async def export_users(premium=None, banned=None, since=None):
+    """
+    Writes the users matching the filters to a new temp file and returns
+    (path, count). The caller removes the file.
+    """
+    cursor = await db.get_all_users(
+        EXPORT_PROJECTION, premium=premium, banned=banned, since=since, batch_size=EXPORT_BATCH
+    )
+    fd, path = tempfile.mkstemp(prefix="users-", suffix=".ndjson.gz")
+    count = 0
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+            writing = None
+            batch = []
+            try:
+                async for user in cursor:
+                    batch.append(user)
+                    if len(batch) < EXPORT_BATCH:
+                        continue
+                    # One write in flight: the next batch is fetched while this one is written
+                    if writing:
+                        await writing
+                    writing = asyncio.ensure_future(asyncio.to_thread(_write_users, gz, batch))
+                    count += len(batch)
+                    batch = []
+            finally:
+                # The thread must be done with the file before it is closed
+                if writing:
+                    await asyncio.wait([writing])
+            if writing:
+                await writing
+            if batch:
+                await asyncio.to_thread(_write_users, gz, batch)
+                count += len(batch)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, count
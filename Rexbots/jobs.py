@@ -0,0 +1,126 @@
+# Rexbots
+# Don't Remove Credit
+# Telegram Channel @RexBots_Official
+
+import asyncio
+import os
+import socket
+
+from config import JOB_LEASE
+from database.db import db
+from logger import LOGGER
+
+logger = LOGGER(__name__)
+
+# ==============================================================================
+# 🧾 PERSISTENT SAVE JOBS
+# Ranges are stored in the `jobs` collection and run under a renewable lease,
+# so a restart (or a dead worker) only delays them.
+# ==============================================================================
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"  # Lease owner for this process
+JOB_POLL_INTERVAL = 15  # Seconds between claim attempts for orphaned jobs
+
+
+class LeasedJob(object):
+    """
+    A claimed job doc plus its lease. Renews the lease in the background,
+    records each finished message, and tracks `last_done`, the id below which
+    everything is finished and where a resume starts.
+    `lost` turns True when another worker took the job over, `cancelled`
+    when the job was cancelled from outside (e.g. /cancel in another process).
+    """
+
+    def __init__(self, job, owner=WORKER_ID):
+        self.job = job
+        self.id = job['_id']
+        self.owner = owner
+        self.last_done = job.get('last_done', job['from_id'] - 1)
+        self.lost = False
+        self.cancelled = False
+        self._finished = {}  # seq -> highest msg id of that item
+        self._next = 0
+        self._renewer = None
+
+    def pending_ids(self):
+        """Ids still to process: after the resume point and not already recorded."""
+        status = self.job.get('status', {})
+        start = max(self.job['from_id'], self.last_done + 1)
+        return [i for i in range(start, self.job['to_id'] + 1) if str(i) not in status]
+
+    @property
+    def stopped(self):
+        return self.lost or self.cancelled
+
+    async def _lease_failed(self):
+        job = await db.get_job(self.id)
+        if job and job.get('state') == "cancelled":
+            self.cancelled = True
+        else:
+            logger.warning(f"Lost lease on job {self.id}")
+            self.lost = True
+
+    def start(self):
+        self._renewer = asyncio.create_task(self._renew())
+
+    async def _renew(self):
+        while not self.stopped:
+            await asyncio.sleep(JOB_LEASE / 3)
+            try:
+                if not await db.renew_lease(self.id, self.owner, JOB_LEASE):
+                    await self._lease_failed()
+            except Exception as e:
+                logger.warning(f"Lease renewal for job {self.id} failed: {e}")
+
+    async def record(self, seq, msgids, status, quota_used):
+        # Items finish out of order; last_done only advances over a finished prefix
+        self._finished[seq] = max(msgids)
+        while self._next in self._finished:
+            self.last_done = max(self.last_done, self._finished.pop(self._next))
+            self._next += 1
+        try:
+            if not await db.checkpoint_job(self.id, self.owner, {m: status for m in msgids}, self.last_done, quota_used):
+                await self._lease_failed()
+        except Exception as e:
+            logger.warning(f"Checkpoint for job {self.id} failed: {e}")
+
+    async def finish(self, state):
+        self.stop()
+        if not self.stopped:
+            await db.finish_job(self.id, self.owner, state)
+
+    async def release(self):
+        self.stop()
+        if not self.stopped:
+            await db.release_job(self.id, self.owner)
+
+    def stop(self):
+        if self._renewer and not self._renewer.done():
+            self._renewer.cancel()
+
+
+class WorkerHeartbeat(object):
+    """
+    Publishes this process's liveness to the `workers` collection. A worker
+    that stops beating is reaped and its jobs' leases are freed for others.
+    """
+
+    def __init__(self, running=lambda: 0, worker_id=WORKER_ID):
+        self.worker_id = worker_id
+        self.running = running
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._beat())
+
+    async def _beat(self):
+        while True:
+            try:
+                await db.beat_worker(self.worker_id, self.running())
+            except Exception as e:
+                logger.warning(f"Heartbeat failed: {e}")
+            await asyncio.sleep(JOB_LEASE / 3)
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+        await db.remove_worker(self.worker_id)
@@ -6,7 +6,7 @@ from pyrogram.types import (
     InlineKeyboardButton
 )
 from database.db import db
-from config import ADMINS
+from config import ADMINS, FREE_DAILY_LIMIT
 from datetime import date, datetime, timedelta
 from logger import LOGGER
 
@@ -26,7 +26,7 @@ async def my_plan(client: Client, message: Message):
         await db.add_user(user_id, message.from_user.first_name)
 
     # 2. Fetch User Data Directly from DB
-    user_data = await db.col.find_one({'id': user_id})
+    user_data = await db.get_user(user_id) or {}
     
     # Defaults
     is_premium = user_data.get('is_premium', False)
@@ -64,7 +64,7 @@ async def my_plan(client: Client, message: Message):
         )
     else:
         # Free Logic
-        daily_limit = 10
+        daily_limit = FREE_DAILY_LIMIT
         tokens_left = max(0, daily_limit - daily_usage)
         
         plan_text = (
@@ -0,0 +1,91 @@
+# Rexbots
+# Don't Remove Credit
+# Telegram Channel @RexBots_Official
+
+import asyncio
+import time
+
+from pyrogram.errors import FloodWait, MessageNotModified
+from Rexbots.ratelimit import bot_limiter
+from logger import LOGGER
+
+logger = LOGGER(__name__)
+
+# ==============================================================================
+# 📡 PROGRESS BUS
+# Transfer callbacks publish the latest status text here; a single editor task
+# pushes throttled edits for every watched status message.
+# ==============================================================================
+EDIT_INTERVAL = 5  # Min seconds between edits of the same status message
+TICK = 1           # Editor loop resolution
+
+
+class _Watch(object):
+    def __init__(self, client, chat_id, message_id):
+        self.client = client
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = None
+        self.dirty = False
+        self.last_edit = 0
+
+
+class ProgressBus(object):
+    """
+    In-process progress registry keyed by task id.
+    attach() starts watching a status message, publish() stores the newest
+    text (older unsent updates are simply overwritten), finish() stops it.
+    The editor task exits on its own once nothing is being watched.
+    """
+
+    def __init__(self):
+        self._watches = {}
+        self._editor = None
+
+    def attach(self, task_id, client, chat_id, message_id):
+        self._watches[task_id] = _Watch(client, chat_id, message_id)
+        if self._editor is None or self._editor.done():
+            self._editor = asyncio.create_task(self._run())
+
+    def publish(self, task_id, text):
+        watch = self._watches.get(task_id)
+        if watch is None or watch.text == text:
+            return
+        watch.text = text
+        watch.dirty = True
+
+    def finish(self, task_id):
+        self._watches.pop(task_id, None)
+
+    def __contains__(self, task_id):
+        return task_id in self._watches
+
+    async def _run(self):
+        while self._watches:
+            now = time.monotonic()
+            pending = [
+                (task_id, watch) for task_id, watch in list(self._watches.items())
+                if watch.dirty and now - watch.last_edit >= EDIT_INTERVAL
+            ]
+            for task_id, watch in pending:
+                # The transfer may have finished while earlier edits were in flight
+                if self._watches.get(task_id) is not watch:
+                    continue
+                # Don't stall every other status message behind a flood-waiting chat
+                if bot_limiter.remaining(watch.chat_id):
+                    continue
+                watch.dirty = False
+                watch.last_edit = time.monotonic()
+                try:
+                    # Edits are droppable: no retry, the limiter holds later sends back instead
+                    await bot_limiter.call_once(watch.chat_id, watch.client.edit_message_text, watch.chat_id, watch.message_id, watch.text)
+                except FloodWait:
+                    watch.dirty = True
+                except MessageNotModified:
+                    pass
+                except Exception as e:
+                    logger.debug(f"Progress edit failed for {task_id}: {e}")
+            await asyncio.sleep(TICK)
+
+
+progress_bus = ProgressBus()
@@ -0,0 +1,270 @@
+# Rexbots
+# Don't Remove Credit
+# Telegram Channel @RexBots_Official
+
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict
+
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+
+from config import BOT_RATE, CHAT_RATE, USER_RATE, SENDING_PROCESSES, CHAT_SENDERS
+from logger import LOGGER
+
+logger = LOGGER(__name__)
+
+# ==============================================================================
+# 🚦 RATE LIMITING
+# Token buckets and FloodWait gates; RateLimiter combines them into the one
+# layer every send goes through.
+# ==============================================================================
+
+# True while a call runs under a RateLimiter (inherited by tasks it starts)
+_limited = contextvars.ContextVar("limited", default=False)
+
+
+class LimitedInvoke(object):
+    """
+    Client mixin: inside a RateLimiter call every FloodWait is raised, so the
+    limiter sees it and backs off; anywhere else Pyrogram keeps sleeping
+    through the ones under sleep_threshold.
+    """
+
+    async def invoke(self, query, *args, **kwargs):
+        if _limited.get() and len(args) < 3:
+            kwargs["sleep_threshold"] = 0
+        return await super().invoke(query, *args, **kwargs)
+
+
+class LimitedClient(LimitedInvoke, Client):
+    """Plain Client with LimitedInvoke, for user clients."""
+
+
+class TokenBucket(object):
+    """
+    Classic token bucket: `rate` tokens per second, bursts up to `capacity`.
+    Waiters are served in arrival order.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens=1):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class FloodGate(object):
+    """
+    Shared FloodWait pause: one caller trips it, every caller waits it out.
+    """
+
+    def __init__(self):
+        self._until = 0.0
+
+    def trip(self, seconds):
+        self._until = max(self._until, time.monotonic() + seconds)
+
+    @property
+    def remaining(self):
+        return max(0.0, self._until - time.monotonic())
+
+    async def wait(self):
+        delay = self.remaining
+        while delay > 0:
+            await asyncio.sleep(delay)
+            # Another caller may have extended the pause meanwhile
+            delay = self.remaining
+
+
+class AdaptiveBucket(TokenBucket):
+    """
+    Token bucket whose rate follows FloodWait feedback: each FloodWait halves
+    it (down to `min_rate`), each success adds `step` back up to the
+    configured rate. The burst size shrinks along with the rate.
+    """
+
+    BACKOFF = 0.5  # Rate multiplier per FloodWait
+
+    def __init__(self, rate, capacity=None, min_rate=None, step=None):
+        super().__init__(rate, capacity)
+        self.max_rate = self.rate
+        self.min_rate = min_rate or self.max_rate / 20
+        self.step = step or self.max_rate / 20
+
+    def _refill(self):
+        now = time.monotonic()
+        burst = max(1.0, self.capacity * self.rate / self.max_rate)
+        self._tokens = min(burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def backoff(self):
+        self._refill()
+        self.rate = max(self.min_rate, self.rate * self.BACKOFF)
+        self._tokens = 0.0
+
+    def recover(self):
+        if self.rate < self.max_rate:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.step)
+
+
+class _ChatLimit(object):
+    def __init__(self, rate, capacity):
+        self.bucket = AdaptiveBucket(rate, capacity)
+        self.gate = FloodGate()
+
+
+class RateLimiter(object):
+    """
+    The pacing layer for one account's API calls. Every call takes a token from
+    the account-wide bucket and, when aimed at a chat, from that chat's bucket.
+    A FloodWait pauses the account and the chat for the requested time and
+    halves both rates; successes win the rate back step by step.
+    """
+
+    CHAT_BURST = 3      # Messages a chat may receive back to back
+    MAX_CHATS = 5000    # Per-chat buckets kept (LRU); an idle bucket is full anyway
+    MAX_WAIT = 300      # Longer FloodWaits are raised instead of waited out
+
+    def __init__(self, name, rate, chat_rate=None, attempts=3):
+        self.name = name
+        self.chat_rate = chat_rate
+        self.attempts = attempts
+        self.bucket = AdaptiveBucket(rate)
+        self.gate = FloodGate()
+        self.floods = 0
+        self._chats = OrderedDict()  # chat_id -> _ChatLimit
+
+    def _chat(self, chat_id):
+        if chat_id is None or not self.chat_rate:
+            return None
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatLimit(self.chat_rate, self.CHAT_BURST)
+            if len(self._chats) > self.MAX_CHATS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return chat
+
+    async def acquire(self, chat_id=None):
+        # Chat first, so a call held back by its chat doesn't sit on an account token
+        chat = self._chat(chat_id)
+        if chat:
+            await chat.gate.wait()
+            await chat.bucket.acquire()
+        await self.gate.wait()
+        await self.bucket.acquire()
+
+    def flood(self, seconds, chat_id=None):
+        # Telegram doesn't say which limit was hit, so both scopes back off
+        self.floods += 1
+        self.gate.trip(seconds)
+        self.bucket.backoff()
+        chat = self._chat(chat_id)
+        if chat:
+            chat.gate.trip(seconds)
+            chat.bucket.backoff()
+        logger.warning(f"[{self.name}] FloodWait {seconds}s (chat {chat_id}), rate now {self.bucket.rate:.2f}/s")
+
+    async def wait_flood(self, seconds, chat_id=None):
+        """
+        Reports a FloodWait raised outside call() (transfer parts, which
+        aren't paced per call) and waits out the shared gate.
+        """
+        self.flood(seconds, chat_id)
+        await self.gate.wait()
+
+    def success(self, chat_id=None):
+        self.bucket.recover()
+        chat = self._chats.get(chat_id)
+        if chat:
+            chat.bucket.recover()
+
+    def remaining(self, chat_id=None):
+        """Seconds until calls to `chat_id` (or any call) may go out again."""
+        chat = self._chats.get(chat_id)
+        return max(self.gate.remaining, chat.gate.remaining if chat else 0.0)
+
+    async def call(self, chat_id, func, *args, **kwargs):
+        """
+        Awaits func(*args, **kwargs) paced for `chat_id` (None for calls not
+        aimed at a chat), retrying FloodWaits up to `attempts` times.
+        """
+        return await self._call(self.attempts, chat_id, func, *args, **kwargs)
+
+    async def call_once(self, chat_id, func, *args, **kwargs):
+        """Like call() but never retries, for uploads and droppable edits."""
+        return await self._call(1, chat_id, func, *args, **kwargs)
+
+    async def call_until_sent(self, chat_id, func, *args, **kwargs):
+        """
+        Like call() but retries every FloodWait however long it is, for sends
+        that must not be dropped (broadcasts). The gate does the waiting.
+        """
+        return await self._call(None, chat_id, func, *args, **kwargs)
+
+    async def _call(self, attempts, chat_id, func, *args, **kwargs):
+        # attempts=None retries FloodWaits without limit
+        attempt = 0
+        while True:
+            attempt += 1
+            await self.acquire(chat_id)
+            token = _limited.set(True)
+            try:
+                result = await func(*args, **kwargs)
+            except FloodWait as e:
+                self.flood(e.value, chat_id)
+                if attempts is not None and (attempt >= attempts or e.value > self.MAX_WAIT):
+                    raise
+                continue
+            finally:
+                _limited.reset(token)
+            self.success(chat_id)
+            return result
+
+    def state(self):
+        return {
+            "rate": round(self.bucket.rate, 2),
+            "max_rate": self.bucket.max_rate,
+            "wait": round(self.gate.remaining, 1),
+            "chats_waiting": sum(1 for chat in self._chats.values() if chat.gate.remaining),
+            "floods": self.floods,
+        }
+
+
+_user_limiters = OrderedDict()  # user_id -> RateLimiter (LRU)
+MAX_USER_LIMITERS = 1000
+
+
+def user_limiter(user_id):
+    """The limiter for a user's own client; every account has its own limits."""
+    limiter = _user_limiters.get(user_id)
+    if limiter is None:
+        limiter = _user_limiters[user_id] = RateLimiter(f"user:{user_id}", USER_RATE)
+        if len(_user_limiters) > MAX_USER_LIMITERS:
+            _user_limiters.popitem(last=False)
+    else:
+        _user_limiters.move_to_end(user_id)
+    return limiter
+
+
+# Shared by every bot call in this process, with its share of the bot-wide limits
+bot_limiter = RateLimiter("bot", BOT_RATE / SENDING_PROCESSES, chat_rate=CHAT_RATE / CHAT_SENDERS)
@@ -0,0 +1,262 @@
+# Rexbots
+# Don't Remove Credit
+# Telegram Channel @RexBots_Official
+
+import asyncio
+import math
+import mimetypes
+from collections import deque
+
+from pyrogram import raw, types, utils
+from pyrogram.errors import FloodWait
+from config import RELAY_MODE, RELAY_BUFFER_MB
+from Rexbots.downloader import CHUNK_SIZE, DOWNLOAD_RETRIES, RETRY_DELAY, iter_chunks, resumable
+from Rexbots.ratelimit import bot_limiter
+from logger import LOGGER
+
+logger = LOGGER(__name__)
+
+# ==============================================================================
+# ⚡ STREAMING RELAY
+# The user client streams parts into a bounded in-memory ring buffer while the
+# bot client uploads them, so download and upload overlap and nothing is staged
+# on disk.
+# ==============================================================================
+PART_SIZE = 512 * 1024              # Telegram upload part size (downloads yield 1 MiB chunks)
+RELAY_MIN_SIZE = 10 * 1024 * 1024   # Smaller files are cheaper through the disk path (and need md5 parts)
+UPLOAD_WORKERS = 4
+PART_ATTEMPTS = 3
+THUMB_HEAD = 8 * 1024 * 1024        # Start of a relayed file kept for make_thumb
+
+RELAY_TYPES = ("Document", "Video", "Audio")
+
+
+class RelayAborted(Exception):
+    pass
+
+
+class RingBuffer(object):
+    """
+    Bounded chunk buffer between one writer (download) and one reader (upload).
+    The writer blocks while `capacity` chunks are pending; close() wakes both
+    sides and optionally hands the reader an error.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._chunks = deque()
+        self._closed = False
+        self._error = None
+        self._cond = asyncio.Condition()
+
+    async def write(self, chunk):
+        async with self._cond:
+            await self._cond.wait_for(lambda: len(self._chunks) < self.capacity or self._closed)
+            if self._closed:
+                raise RelayAborted("Reader closed the relay")
+            self._chunks.append(chunk)
+            self._cond.notify_all()
+
+    async def read(self):
+        """Returns the next chunk, b"" at end of stream."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._chunks or self._closed)
+            if self._chunks:
+                chunk = self._chunks.popleft()
+                self._cond.notify_all()
+                return chunk
+            if self._error:
+                raise self._error
+            return b""
+
+    async def close(self, error=None):
+        async with self._cond:
+            if not self._closed:
+                self._closed = True
+                self._error = error
+            self._cond.notify_all()
+
+
+def can_relay(msg_type, file_size):
+    return RELAY_MODE and msg_type in RELAY_TYPES and file_size >= RELAY_MIN_SIZE
+
+
+def media_file_name(msg, msg_type):
+    """Original file name, or a stable fallback with an extension guessed from the mime type."""
+    media = getattr(msg, msg_type.lower())
+    if getattr(media, "file_name", None):
+        return media.file_name
+    ext = mimetypes.guess_extension(getattr(media, "mime_type", None) or "") or ""
+    return f"{msg_type.lower()}_{msg.id}{ext}"
+
+
+async def _pump(acc, msg, msg_type, ring, limiter, head=None):
+    # An interrupted download restarts at the first byte not yet in the ring,
+    # up to DOWNLOAD_RETRIES times; the upload side never notices
+    written = 0
+    try:
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            skip = written % CHUNK_SIZE
+            try:
+                async for chunk in iter_chunks(acc, msg, msg_type, limiter, written // CHUNK_SIZE):
+                    if skip:
+                        chunk, skip = chunk[skip:], 0
+                    if head is not None and len(head) < THUMB_HEAD:
+                        head += chunk[:THUMB_HEAD - len(head)]
+                    await ring.write(chunk)
+                    written += len(chunk)
+                break
+            except Exception as e:
+                if attempt == DOWNLOAD_RETRIES or not resumable(e):
+                    raise
+                logger.warning(f"Relay download of {msg.id} interrupted at {written} bytes ({e}), resuming ({attempt + 1}/{DOWNLOAD_RETRIES})")
+                await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
+    except RelayAborted:
+        return
+    except Exception as e:
+        await ring.close(e)
+        raise
+    await ring.close()
+
+
+async def upload_from_ring(client, ring, file_size, file_name, progress=None, progress_args=()):
+    """
+    Uploads parts read from `ring` with several concurrent SaveBigFilePart
+    calls and returns the InputFileBig for the finished file.
+    """
+    file_id = client.rnd_id()
+    total_parts = math.ceil(file_size / PART_SIZE)
+    parts = asyncio.Queue(UPLOAD_WORKERS * 2)
+    state = {"uploaded": 0, "parts": 0}
+
+    async def feeder():
+        index = 0
+        pending = b""
+        while True:
+            chunk = await ring.read()
+            if not chunk:
+                break
+            pending += chunk
+            while len(pending) >= PART_SIZE:
+                await parts.put((index, pending[:PART_SIZE]))
+                pending = pending[PART_SIZE:]
+                index += 1
+        if pending:
+            await parts.put((index, pending))
+            index += 1
+        state["parts"] = index
+        for _ in range(UPLOAD_WORKERS):
+            await parts.put(None)
+
+    async def worker():
+        while True:
+            item = await parts.get()
+            if item is None:
+                return
+            index, data = item
+            attempt = 0
+            while True:
+                try:
+                    await client.invoke(raw.functions.upload.SaveBigFilePart(
+                        file_id=file_id,
+                        file_part=index,
+                        file_total_parts=total_parts,
+                        bytes=data
+                    ))
+                    break
+                except FloodWait as e:
+                    # Waited out on the bot's shared gate; doesn't use up an attempt
+                    await bot_limiter.wait_flood(e.value)
+                except Exception as e:
+                    attempt += 1
+                    if attempt == PART_ATTEMPTS:
+                        raise
+                    logger.warning(f"Relay part {index} failed, retrying: {e}")
+                    await asyncio.sleep(1)
+            state["uploaded"] += len(data)
+            if progress:
+                await progress(min(state["uploaded"], file_size), file_size, *progress_args)
+
+    tasks = [asyncio.create_task(feeder())] + [asyncio.create_task(worker()) for _ in range(UPLOAD_WORKERS)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if state["parts"] != total_parts:
+        raise ValueError(f"Relay size mismatch: got {state['parts']} parts, expected {total_parts}")
+    return raw.types.InputFileBig(id=file_id, parts=total_parts, name=file_name)
+
+
+async def send_uploaded(client, chat_id, input_file, msg, msg_type, caption=None, thumb=None):
+    """
+    Sends an already uploaded file as the same media type as `msg`.
+    `thumb` is an optional local thumbnail path.
+    """
+    media = getattr(msg, msg_type.lower())
+    attributes = [raw.types.DocumentAttributeFilename(file_name=input_file.name)]
+    if msg_type == "Video":
+        attributes.append(raw.types.DocumentAttributeVideo(
+            duration=media.duration or 0,
+            w=media.width or 0,
+            h=media.height or 0,
+            supports_streaming=True
+        ))
+    elif msg_type == "Audio":
+        attributes.append(raw.types.DocumentAttributeAudio(
+            duration=media.duration or 0,
+            performer=media.performer,
+            title=media.title
+        ))
+
+    r = await client.invoke(raw.functions.messages.SendMedia(
+        peer=await client.resolve_peer(chat_id),
+        media=raw.types.InputMediaUploadedDocument(
+            mime_type=media.mime_type or "application/octet-stream",
+            file=input_file,
+            thumb=await client.save_file(thumb) if thumb else None,
+            attributes=attributes
+        ),
+        random_id=client.rnd_id(),
+        **await utils.parse_text_entities(client, caption or "", None, None)
+    ))
+
+    for update in r.updates:
+        if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await types.Message._parse(
+                client, update.message,
+                {u.id: u for u in r.users},
+                {c.id: c for c in r.chats}
+            )
+
+
+async def relay_media(client, acc, msg, msg_type, chat_id, file_name, file_size, limiter, caption=None, thumb=None, make_thumb=None, progress=None, progress_args=(), before_send=None):
+    """
+    Streams `msg` from the user client straight into an upload by the bot client.
+    Peak memory is about RELAY_BUFFER_MB plus a few in-flight parts per file.
+    `before_send` is awaited between upload and send, e.g. to keep range order.
+    `limiter` is the user's RateLimiter, for the download side.
+    Without `thumb`, `make_thumb(head)` may return one made from the file's
+    first THUMB_HEAD bytes.
+    """
+    ring = RingBuffer(RELAY_BUFFER_MB)
+    head = bytearray() if thumb is None and make_thumb else None
+    pump = asyncio.create_task(_pump(acc, msg, msg_type, ring, limiter, head))
+    try:
+        input_file = await upload_from_ring(client, ring, file_size, file_name, progress, progress_args)
+        await pump
+    except BaseException:
+        pump.cancel()
+        await ring.close()
+        await asyncio.gather(pump, return_exceptions=True)
+        raise
+    if head:
+        try:
+            thumb = await make_thumb(bytes(head))
+        except Exception as e:
+            logger.warning(f"Relay thumbnail failed: {e}")
+    if before_send:
+        await before_send()
+    # The bytes are already uploaded, so a FloodWait only costs a retry of the send
+    return await bot_limiter.call(chat_id, send_uploaded, client, chat_id, input_file, msg, msg_type, caption, thumb)
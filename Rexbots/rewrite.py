@@ -0,0 +1,62 @@
+# Rexbots
+# Don't Remove Credit
+# Telegram Channel @RexBots_Official
+
+import os
+import re
+from collections import OrderedDict
+
+from database.db import db
+
+# ==============================================================================
+# ✂️ CAPTION / FILE NAME REWRITING
+# A user's delete and replace words compiled into one pattern, rebuilt only
+# when their `words_version` changes.
+# ==============================================================================
+MAX_REWRITERS = 1000  # Compiled rewriters kept (LRU)
+
+_rewriters = OrderedDict()  # user_id -> (words_version, Rewriter)
+
+
+class Rewriter(object):
+    """
+    Rewrites text in one pass over a single alternation of every term, however
+    many words the user has. Longer terms are tried first, so a term wins over
+    its own prefix; a word both deleted and replaced is replaced.
+    """
+
+    def __init__(self, delete_words=(), replace_words=None):
+        self.table = {word: "" for word in delete_words if word}
+        self.table.update({target: repl for target, repl in (replace_words or {}).items() if target})
+        terms = sorted(self.table, key=len, reverse=True)
+        self.pattern = re.compile("|".join(map(re.escape, terms))) if terms else None
+
+    def __call__(self, text):
+        if not text or self.pattern is None:
+            return text
+        return self.pattern.sub(lambda m: self.table[m.group(0)], text)
+
+    def file_name(self, name):
+        """Rewrites the name but not the extension; never yields an empty or nested path."""
+        if self.pattern is None:
+            return name
+        stem, ext = os.path.splitext(name)
+        stem = self(stem).replace("/", "_").replace("\\", "_").strip()
+        return f"{stem}{ext}" if stem else name
+
+
+async def get_rewriter(user_id):
+    """The user's compiled Rewriter, recompiled only after their words changed."""
+    user = await db.get_user(user_id) or {}
+    version = user.get('words_version', 0)
+    entry = _rewriters.get(user_id)
+    if entry and entry[0] == version:
+        _rewriters.move_to_end(user_id)
+        return entry[1]
+    delete_words, replace_words = await db.get_words(user_id)
+    rewriter = Rewriter(delete_words, replace_words)
+    _rewriters[user_id] = (version, rewriter)
+    _rewriters.move_to_end(user_id)
+    while len(_rewriters) > MAX_REWRITERS:
+        _rewriters.popitem(last=False)
+    return rewriter
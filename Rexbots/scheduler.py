@@ -0,0 +1,171 @@
+# Rexbots
+# Don't Remove Credit
+# Telegram Channel @RexBots_Official
+
+import asyncio
+from collections import OrderedDict, deque
+
+from config import MAX_DOWNLOADS, MAX_UPLOADS, PREMIUM_WEIGHT, TRANSFER_PROCESSES
+from database.db import db
+from logger import LOGGER
+
+logger = LOGGER(__name__)
+
+# ==============================================================================
+# 🗂️ TRANSFER SCHEDULER
+# Global budget of concurrent downloads and uploads. Waiters queue in a premium
+# and a free lane; lanes are served PREMIUM_WEIGHT:1 and users within a lane
+# round-robin, so one big range can't starve everyone else.
+# ==============================================================================
+
+
+class _Waiter(object):
+    def __init__(self, user_id, premium, on_position):
+        self.user_id = user_id
+        self.premium = premium
+        self.on_position = on_position
+        self.position = None
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class TransferLane(object):
+    """
+    A capped pool of transfer slots with weighted fair queuing.
+    Use `async with lane.slot(user_id, on_position=...)`; `on_position(n)` is
+    called whenever a waiting request's place in line changes.
+    """
+
+    def __init__(self, name, capacity, premium_weight=PREMIUM_WEIGHT):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.premium_weight = max(1, premium_weight)
+        self.active = 0
+        self._queues = {True: OrderedDict(), False: OrderedDict()}  # user_id -> deque of waiters
+        self._premium_streak = 0
+
+    def slot(self, user_id, on_position=None):
+        return _Slot(self, user_id, on_position)
+
+    @property
+    def waiting(self):
+        return sum(len(q) for lane in self._queues.values() for q in lane.values())
+
+    async def acquire(self, user_id, on_position=None):
+        premium = bool(await db.check_premium(user_id))
+        if self.active < self.capacity and not self.waiting:
+            self.active += 1
+            return
+        waiter = _Waiter(user_id, premium, on_position)
+        self._queues[premium].setdefault(user_id, deque()).append(waiter)
+        self._report()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as we were cancelled, hand the slot on
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+
+    def release(self):
+        self.active = max(0, self.active - 1)
+        while self.active < self.capacity:
+            waiter = self._pop()
+            if waiter is None:
+                break
+            if waiter.future.done():
+                continue
+            self.active += 1
+            waiter.future.set_result(None)
+        self._report()
+
+    def _pick_lane(self, premium_streak, has_premium, has_free):
+        if has_premium and (not has_free or premium_streak < self.premium_weight):
+            return True
+        return False
+
+    def _pop(self):
+        premium = self._pick_lane(self._premium_streak, bool(self._queues[True]), bool(self._queues[False]))
+        lane = self._queues[premium]
+        if not lane:
+            return None
+        self._premium_streak = self._premium_streak + 1 if premium else 0
+        return self._pop_from(lane)
+
+    @staticmethod
+    def _pop_from(lane):
+        user_id, queue = next(iter(lane.items()))
+        waiter = queue.popleft()
+        if queue:
+            lane.move_to_end(user_id)  # Round-robin: this user goes to the back
+        else:
+            del lane[user_id]
+        return waiter
+
+    def _remove(self, waiter):
+        lane = self._queues[waiter.premium]
+        queue = lane.get(waiter.user_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del lane[waiter.user_id]
+        self._report()
+
+    def _order(self):
+        # Replays the dispatch order on copies of the queues
+        lanes = {p: OrderedDict((u, deque(q)) for u, q in lane.items()) for p, lane in self._queues.items()}
+        streak = self._premium_streak
+        order = []
+        while lanes[True] or lanes[False]:
+            premium = self._pick_lane(streak, bool(lanes[True]), bool(lanes[False]))
+            streak = streak + 1 if premium else 0
+            order.append(self._pop_from(lanes[premium]))
+        return order
+
+    def _report(self):
+        for position, waiter in enumerate(self._order(), start=1):
+            if waiter.on_position and waiter.position != position:
+                waiter.position = position
+                try:
+                    waiter.on_position(position)
+                except Exception as e:
+                    logger.debug(f"Queue position callback failed: {e}")
+
+
+class _Slot(object):
+    def __init__(self, lane, user_id, on_position):
+        self.lane = lane
+        self.user_id = user_id
+        self.on_position = on_position
+        self.held = False
+
+    async def __aenter__(self):
+        await self.lane.acquire(self.user_id, self.on_position)
+        self.held = True
+        return self
+
+    def release(self):
+        """Gives the slot back early; leaving the block afterwards is a no-op."""
+        if self.held:
+            self.held = False
+            self.lane.release()
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class TransferScheduler(object):
+    def __init__(self):
+        # Each worker process gets its share of the limits across all users
+        self.downloads = TransferLane("downloads", max(1, MAX_DOWNLOADS // TRANSFER_PROCESSES))
+        self.uploads = TransferLane("uploads", max(1, MAX_UPLOADS // TRANSFER_PROCESSES))
+
+    def stats(self):
+        return {
+            lane.name: {"active": lane.active, "waiting": lane.waiting, "capacity": lane.capacity}
+            for lane in (self.downloads, self.uploads)
+        }
+
+
+scheduler = TransferScheduler()
@@ -1,4 +1,5 @@
 import asyncio
+import time
 from pyrogram import Client, filters
 from pyrogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton
 from pyrogram.errors import (
@@ -13,6 +14,8 @@ from pyrogram.errors import (
 from pyrogram import enums
 from config import API_ID, API_HASH
 from database.db import db
+from Rexbots.client_pool import user_pool
+from Rexbots.ratelimit import LimitedClient, bot_limiter, user_limiter
 
 # ==========================================
 # STATE MANAGEMENT
@@ -52,6 +55,9 @@ PROGRESS_BARS = [
     "██████████ 100%"  # Full
 ]
 
+# Shown when Telegram's wait is too long to sit out during a login
+FLOOD_WAIT_TEXT = "<b>⏳ Telegram asks to wait {seconds}s before trying again. Please /login later.</b>"
+
 # Emoji-based loading animation frames (enhanced with more frames for smoothness)
 LOADING_FRAMES = [
     "🔄 Connecting •••",
@@ -73,11 +79,11 @@ async def animate_loading(client: Client, chat_id: int, msg_id: int, duration: i
     while time.time() < end_time:
         frame = LOADING_FRAMES[frame_index % len(LOADING_FRAMES)]
         try:
-            await client.edit_message_text(chat_id, msg_id, f"<b>{frame}</b>", parse_mode=enums.ParseMode.HTML)
-            await asyncio.sleep(0.3)  # Smoother animation speed
+            # The chat's rate limit sets the frame rate
+            await bot_limiter.call_once(chat_id, client.edit_message_text, chat_id, msg_id, f"<b>{frame}</b>", parse_mode=enums.ParseMode.HTML)
             frame_index += 1
-        except FloodWait as fw:
-            await asyncio.sleep(fw.value)
+        except FloodWait:
+            continue  # The limiter holds the next frame back
         except Exception:
             return
 
@@ -99,9 +105,7 @@ async def update_progress(client: Client, chat_id: int, msg_id: int, step: str,
     bar = PROGRESS_BARS[bar_index]
     text = f"<b>Progress: [{bar}]</b>\n<i>{progress_text}</i>\n\n{additional_text}"
     try:
-        await client.edit_message_text(chat_id, msg_id, text, parse_mode=enums.ParseMode.HTML)
-    except FloodWait as fw:
-        await asyncio.sleep(fw.value)
+        await bot_limiter.call(chat_id, client.edit_message_text, chat_id, msg_id, text, parse_mode=enums.ParseMode.HTML)
     except Exception as e:
         pass  # Silent fail to avoid breaking
 
@@ -148,8 +152,9 @@ async def logout(client: Client, message: Message):
     if user_id in LOGIN_STATE:
         del LOGIN_STATE[user_id]
     
-    # Remove from Database
+    # Remove from Database & close the pooled user client
     await db.set_session(user_id, session=None)
+    await user_pool.disconnect(user_id)
     await message.reply(
         "<b>🚪 Logout Successful! 👋</b>\n\n"
         "<i>Your session has been cleared. You can log in again anytime! 🔄</i>",
@@ -225,7 +230,7 @@ async def login_handler(client: Client, message: Message):
             return
         
         # Create temporary client
-        temp_client = Client(
+        temp_client = LimitedClient(
             name=f"session_{user_id}",
             api_id=API_ID,
             api_hash=API_HASH,
@@ -240,9 +245,6 @@ async def login_handler(client: Client, message: Message):
         
         try:
             await temp_client.connect()
-        except FloodWait as fw:
-            await asyncio.sleep(fw.value)
-            await temp_client.connect()
         except Exception as e:
             animation_task.cancel()
             await update_progress(client, chat_id, status_msg_id, step, f"<b>❌ Connection failed: {e}. Please try again.</b>")
@@ -252,7 +254,7 @@ async def login_handler(client: Client, message: Message):
         animation_task.cancel()  # Stop animation once connected
         
         try:
-            code = await temp_client.send_code(phone_number)
+            code = await user_limiter(user_id).call(None, temp_client.send_code, phone_number)
             
             # Save data to state
             state["data"]["client"] = temp_client
@@ -271,17 +273,10 @@ async def login_handler(client: Client, message: Message):
             await temp_client.disconnect()
             del LOGIN_STATE[user_id]
         except FloodWait as fw:
-            await asyncio.sleep(fw.value)
-            # Retry logic if needed
-            await update_progress(client, chat_id, status_msg_id, step, "<b>⚠️ Rate limit hit. Retrying after delay...</b>")
-            # Assuming retry once
-            try:
-                code = await temp_client.send_code(phone_number)
-                # Proceed as above
-            except:
-                await update_progress(client, chat_id, status_msg_id, step, "<b>❌ Failed after retry. Please try later.</b>")
-                await temp_client.disconnect()
-                del LOGIN_STATE[user_id]
+            # Short waits were already retried by the limiter
+            await update_progress(client, chat_id, status_msg_id, step, FLOOD_WAIT_TEXT.format(seconds=fw.value))
+            await temp_client.disconnect()
+            del LOGIN_STATE[user_id]
         except Exception as e:
             await update_progress(client, chat_id, status_msg_id, step, f"<b>❌ Something went wrong: {e} 🤔 Please try /login again.</b>")
             await temp_client.disconnect()
@@ -305,7 +300,7 @@ async def login_handler(client: Client, message: Message):
         animation_task = asyncio.create_task(animate_loading(client, chat_id, status_msg_id, duration=3))
         
         try:
-            await temp_client.sign_in(phone_number, phone_hash, phone_code)
+            await user_limiter(user_id).call(None, temp_client.sign_in, phone_number, phone_hash, phone_code)
             animation_task.cancel()
             
             # Direct Success
@@ -327,15 +322,9 @@ async def login_handler(client: Client, message: Message):
             await update_progress(client, chat_id, status_msg_id, "WAITING_PASSWORD", additional_text)
         except FloodWait as fw:
             animation_task.cancel()
-            await asyncio.sleep(fw.value)
-            await update_progress(client, chat_id, status_msg_id, step, "<b>⚠️ Rate limit hit. Retrying...</b>")
-            try:
-                await temp_client.sign_in(phone_number, phone_hash, phone_code)
-                await finalize_login(client, chat_id, status_msg_id, temp_client, user_id)
-            except:
-                await update_progress(client, chat_id, status_msg_id, step, "<b>❌ Verification failed after retry.</b>")
-                await temp_client.disconnect()
-                del LOGIN_STATE[user_id]
+            await update_progress(client, chat_id, status_msg_id, step, FLOOD_WAIT_TEXT.format(seconds=fw.value))
+            await temp_client.disconnect()
+            del LOGIN_STATE[user_id]
         except Exception as e:
             animation_task.cancel()
             await update_progress(client, chat_id, status_msg_id, step, f"<b>❌ Something went wrong: {e} 🤔</b>")
@@ -352,7 +341,7 @@ async def login_handler(client: Client, message: Message):
         animation_task = asyncio.create_task(animate_loading(client, chat_id, status_msg_id, duration=3))
         
         try:
-            await temp_client.check_password(password=password)
+            await user_limiter(user_id).call(None, temp_client.check_password, password=password)
             animation_task.cancel()
             await finalize_login(client, chat_id, status_msg_id, temp_client, user_id)
         except PasswordHashInvalid:
@@ -360,15 +349,9 @@ async def login_handler(client: Client, message: Message):
             await update_progress(client, chat_id, status_msg_id, step, "<b>❌ Incorrect password. 🔑 Please try again.</b>")
         except FloodWait as fw:
             animation_task.cancel()
-            await asyncio.sleep(fw.value)
-            await update_progress(client, chat_id, status_msg_id, step, "<b>⚠️ Rate limit hit. Retrying...</b>")
-            try:
-                await temp_client.check_password(password=password)
-                await finalize_login(client, chat_id, status_msg_id, temp_client, user_id)
-            except:
-                await update_progress(client, chat_id, status_msg_id, step, "<b>❌ Password check failed after retry.</b>")
-                await temp_client.disconnect()
-                del LOGIN_STATE[user_id]
+            await update_progress(client, chat_id, status_msg_id, step, FLOOD_WAIT_TEXT.format(seconds=fw.value))
+            await temp_client.disconnect()
+            del LOGIN_STATE[user_id]
         except Exception as e:
             animation_task.cancel()
             await update_progress(client, chat_id, status_msg_id, step, f"<b>❌ Something went wrong: {e} 🤔</b>")
@@ -2,6 +2,7 @@ import os
 from pyrogram import Client, filters, enums
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from database.db import db
+from config import FREE_DAILY_LIMIT
 from Rexbots.strings import COMMANDS_TXT
 
 # ======================================================
@@ -181,14 +182,14 @@ async def settings_callbacks(client: Client, callback_query: CallbackQuery):
     elif data == "user_stats_btn":
         # Fetch real stats from DB
         is_premium = await db.check_premium(user_id)
-        user_data = await db.col.find_one({'id': int(user_id)})
+        user_data = await db.get_user(user_id) or {}
         
         if is_premium:
             limit_text = "♾️ Unlimited"
             usage_text = "Ignored (Premium)"
         else:
             # Free user logic
-            daily_limit = 10
+            daily_limit = FREE_DAILY_LIMIT
             used = user_data.get('daily_usage', 0)
             limit_text = f"{daily_limit} Files / 24h"
             usage_text = f"{used} / {daily_limit}"
@@ -0,0 +1,208 @@
+# Rexbots
+# Don't Remove Credit
+# Telegram Channel @RexBots_Official
+
+import asyncio
+import glob
+import os
+import shutil
+from collections import deque
+
+from config import STAGING_MB, TRANSFER_PROCESSES
+from Rexbots.batch import OrderedDelivery
+from logger import LOGGER
+
+logger = LOGGER(__name__)
+
+# ==============================================================================
+# 💾 DOWNLOAD STAGING
+# Downloads reserve their expected size against a disk budget before they
+# start and queue while it is used up, so concurrent large files can't fill
+# the disk mid-transfer. Each process stages under its own directory.
+# ==============================================================================
+STAGING_ROOT = "downloads"
+FREE_SPACE_SHARE = 0.9  # Part of the free disk used as the budget when STAGING_MB is 0
+
+
+class InsufficientSpace(Exception):
+    """The file is larger than the whole staging budget."""
+
+
+class _Reservation(object):
+    def __init__(self, area, nbytes):
+        self.area = area
+        self.nbytes = nbytes
+
+    def release(self):
+        if self.nbytes:
+            self.area._release(self.nbytes)
+            self.nbytes = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class StagingArea(object):
+    """
+    Disk budget for this process's downloads. reserve() waits (FIFO) until
+    the bytes fit and returns a reservation to release once the files are gone.
+    """
+
+    def __init__(self, root=STAGING_ROOT, budget_mb=STAGING_MB):
+        self.root = root
+        self.dir = os.path.join(root, f"proc-{os.getpid()}")
+        self.budget = budget_mb * 1024 * 1024 if budget_mb else None
+        self.reserved = 0
+        self._waiters = deque()  # (nbytes, future)
+
+    def job_dir(self, message):
+        # Message ids are per chat, the chat id keeps two users' jobs apart
+        return os.path.join(self.dir, f"{message.chat.id}-{message.id}")
+
+    def _budget(self):
+        if self.budget is None:
+            os.makedirs(self.root, exist_ok=True)
+            free = shutil.disk_usage(self.root).free
+            # Worker processes share the disk; the bot process doesn't download in WORKER_MODE
+            self.budget = int(free * FREE_SPACE_SHARE / TRANSFER_PROCESSES)
+            logger.info(f"Staging budget: {self.budget / 1024 ** 3:.2f} GB")
+        return self.budget
+
+    def try_reserve(self, nbytes):
+        """Reserves without waiting; None if the bytes don't fit right now."""
+        nbytes = max(0, int(nbytes or 0))
+        if not self._waiters and self.reserved + nbytes <= self._budget():
+            self.reserved += nbytes
+            return _Reservation(self, nbytes)
+        return None
+
+    async def reserve(self, nbytes):
+        nbytes = max(0, int(nbytes or 0))
+        budget = self._budget()
+        if nbytes > budget:
+            raise InsufficientSpace(f"{nbytes} bytes exceed the {budget} byte staging budget")
+        reservation = self.try_reserve(nbytes)
+        if reservation:
+            return reservation
+        future = asyncio.get_running_loop().create_future()
+        waiter = (nbytes, future)
+        self._waiters.append(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(nbytes)
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._grant()
+            raise
+        return _Reservation(self, nbytes)
+
+    def _release(self, nbytes):
+        self.reserved = max(0, self.reserved - nbytes)
+        self._grant()
+
+    def _grant(self):
+        while self._waiters:
+            nbytes, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if self.reserved + nbytes > self.budget:
+                break
+            self._waiters.popleft()
+            self.reserved += nbytes
+            future.set_result(None)
+
+    def stats(self):
+        return {"reserved": self.reserved, "budget": self.budget, "waiting": len(self._waiters)}
+
+    def sweep(self):
+        """
+        Removes what interrupted runs left behind: staging directories of
+        processes that are gone (or of the old flat layout) and *status.txt files.
+        """
+        removed = 0
+        if os.path.isdir(self.root):
+            for name in os.listdir(self.root):
+                if name.startswith("proc-") and name != os.path.basename(self.dir) and _alive(name[5:]):
+                    continue
+                path = os.path.join(self.root, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+                removed += 1
+        for path in glob.glob("*status.txt"):
+            os.remove(path)
+            removed += 1
+        if removed:
+            logger.info(f"Swept {removed} leftover download entries")
+
+
+def _alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class RangeStaging(object):
+    """
+    Hands a range's items their disk reservations in range order. An item
+    waiting for space then only ever waits on earlier items, which already
+    hold theirs and can deliver, so ordered delivery can't deadlock on disk.
+    That holds as long as an item passes its turn only once it knows it won't
+    stage anything; a reserve() after that never waits.
+    """
+
+    def __init__(self, area):
+        self.area = area
+        self._order = OrderedDelivery()
+
+    def item(self, seq):
+        return _ItemStaging(self, seq)
+
+
+class _ItemStaging(object):
+    def __init__(self, staging, seq):
+        self.staging = staging
+        self.seq = seq
+        self._passed = False
+        self._reservation = None
+
+    async def reserve(self, nbytes):
+        if self._passed:
+            # Later items may hold the space while waiting to deliver after this
+            # one, so waiting here could deadlock: take it now or give up
+            self._reservation = self.staging.area.try_reserve(nbytes)
+            if self._reservation is None:
+                raise InsufficientSpace(f"{nbytes} bytes don't fit and the item already passed its turn")
+            return self._reservation
+        try:
+            await self.staging._order.wait_turn(self.seq)
+            self._reservation = await self.staging.area.reserve(nbytes)
+            return self._reservation
+        finally:
+            await self.skip()
+
+    async def skip(self):
+        """Lets later items reserve; for items that stage nothing on disk."""
+        if not self._passed:
+            self._passed = True
+            await self.staging._order.done(self.seq)
+
+    async def finish(self):
+        """Called once the item is over, whichever way it ended."""
+        await self.skip()
+        if self._reservation:
+            self._reservation.release()
+
+
+staging = StagingArea()
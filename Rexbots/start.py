@@ -7,11 +7,26 @@ import pyrogram
 from pyrogram import Client, filters, enums
 from pyrogram.errors import (
     FloodWait, UserIsBlocked, InputUserDeactivated, UserAlreadyParticipant,
-    InviteHashExpired, UsernameNotOccupied, AuthKeyUnregistered, UserDeactivated, UserDeactivatedBan
+    InviteHashExpired, UsernameNotOccupied, AuthKeyUnregistered, UserDeactivated, UserDeactivatedBan,
+    FileIdInvalid, FileReferenceExpired, FileReferenceInvalid, MediaEmpty
 )
-from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery, InputMediaPhoto
-from config import API_ID, API_HASH, ERROR_MESSAGE
+from pyrogram.types import (
+    InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery,
+    InputMediaPhoto, InputMediaVideo, InputMediaAudio, InputMediaDocument
+)
+from config import ERROR_MESSAGE, FREE_DAILY_LIMIT, JOB_LEASE, WORKER_MODE
 from database.db import db
+from Rexbots.client_pool import user_pool
+from Rexbots.progress_bus import progress_bus
+from Rexbots.relay import can_relay, media_file_name, relay_media
+from Rexbots.rewrite import get_rewriter
+from Rexbots.thumbs import thumb_cache, video_thumb, video_thumb_from_head
+from Rexbots.staging import staging, RangeStaging, InsufficientSpace
+from Rexbots.downloader import can_download_parallel, download_parallel
+from Rexbots.batch import BatchExecutor, BatchAborted, RangePrefetcher, batch_workers
+from Rexbots.ratelimit import bot_limiter, user_limiter
+from Rexbots.scheduler import scheduler
+from Rexbots.jobs import LeasedJob, WORKER_ID, JOB_POLL_INTERVAL
 import math
 from logger import LOGGER
 # ==============================================================================
@@ -24,7 +39,7 @@ PICS = (os.environ.get('PICS', 'https://i.postimg.cc/26ZBtBZr/13.png https://i.p
 SUBSCRIPTION = os.environ.get('SUBSCRIPTION', 'https://graph.org/file/242b7f1b52743938d81f1.jpg')
 # --- Operational Limits ---
 FREE_LIMIT_SIZE = 2 * 1024 * 1024 * 1024 # 2 GB Limit for Free Users
-FREE_LIMIT_DAILY = 10 # 10 Files per 24h
+FREE_LIMIT_DAILY = FREE_DAILY_LIMIT # 10 Files per 24h (default)
 # --- Payment Info ---
 UPI_ID = os.environ.get("UPI_ID", "your_upi@oksbi")
 QR_CODE = os.environ.get("QR_CODE", "https://graph.org/file/your_qr_code.jpg")
@@ -126,6 +141,13 @@ Remove all restrictions and enjoy seamless downloading.
 <b>Free tier limited to 2GB per file.</b>
 <blockquote><b>🔓 Upgrade to Premium</b></blockquote>
 Download files up to 4GB and beyond with no limits!
+"""
+    JOB_QUEUED = """<b>📥 Request Queued</b>
+<i>A worker will pick it up shortly, progress appears here. Use /cancel to stop it.</i>
+"""
+    QUEUED = """<b>⏳ Queued</b>
+<blockquote><b>📍 Position in line:</b> <code>{position}</code></blockquote>
+<i>The bot is busy, your file starts automatically. Premium users are served first.</i>
 """
 # ==============================================================================
 # 🛠️ UTILITY FUNCTIONS
@@ -152,8 +174,39 @@ def TimeFormatter(milliseconds: int) -> str:
     return tmp[:-2] if tmp else "0s"
 class batch_temp(object):
     IS_BATCH = {}
+    TASKS = {}  # user_id -> running range task
+    JOBS = {}   # user_id -> LeasedJob of the running range
 class settings_temp(object):
     STATE = {}
+class QuotaReservation(object):
+    """
+    Daily-quota units reserved up front for one range.
+    granted=None means unlimited (premium); unused units are refunded at the end.
+    """
+    def __init__(self, granted, remaining=None):
+        self.granted = None if remaining is None else granted
+        self.used = 0
+        self.denied = 0
+    @property
+    def exhausted(self):
+        return self.granted is not None and self.used >= self.granted
+    @property
+    def unused(self):
+        return 0 if self.granted is None else self.granted - self.used
+    def take(self):
+        if self.exhausted:
+            self.denied += 1
+            return False
+        self.used += 1
+        return True
+    def give_back(self):
+        self.used = max(0, self.used - 1)
+    @classmethod
+    def restore(cls, granted, used):
+        """Rebuilds a job's reservation; granted=None is unlimited."""
+        quota = cls(granted, None if granted is None else 0)
+        quota.used = used
+        return quota
 def get_message_type(msg):
     if getattr(msg, 'document', None): return "Document"
     if getattr(msg, 'video', None): return "Video"
@@ -161,34 +214,18 @@ def get_message_type(msg):
     if getattr(msg, 'audio', None): return "Audio"
     if getattr(msg, 'text', None): return "Text"
     return None
+def get_file_size(msg, msg_type):
+    # Photos don't count towards the size limit
+    if msg_type in ("Document", "Video", "Audio"):
+        return getattr(msg, msg_type.lower()).file_size
+    return 0
 # ==============================================================================
 # 📊 PROGRESS BAR ENGINE (Upgraded to Professional)
 # ==============================================================================
-async def downstatus(client, statusfile, message, chat):
-    while not os.path.exists(statusfile):
-        await asyncio.sleep(3)
-    while os.path.exists(statusfile):
-        try:
-            with open(statusfile, "r", encoding='utf-8') as downread:
-                txt = downread.read()
-            await client.edit_message_text(chat, message.id, f"{txt}")
-            await asyncio.sleep(5)
-        except:
-            await asyncio.sleep(5)
-async def upstatus(client, statusfile, message, chat):
-    while not os.path.exists(statusfile):
-        await asyncio.sleep(3)
-    while os.path.exists(statusfile):
-        try:
-            with open(statusfile, "r", encoding='utf-8') as upread:
-                txt = upread.read()
-            await client.edit_message_text(chat, message.id, f"{txt}")
-            await asyncio.sleep(5)
-        except:
-            await asyncio.sleep(5)
-def progress(current, total, message, type):
-    # Check Cancel
-    if batch_temp.IS_BATCH.get(message.from_user.id):
+async def progress(current, total, message, type):
+    # Check Cancel (a /cancel handled by another process reaches us through the job's lease)
+    leased = batch_temp.JOBS.get(message.from_user.id)
+    if batch_temp.IS_BATCH.get(message.from_user.id) or (leased and leased.cancelled):
         raise Exception("Cancelled")
     if not hasattr(progress, "cache"):
         progress.cache = {}
@@ -202,7 +239,8 @@ def progress(current, total, message, type):
     if task_id not in progress.start_time:
         progress.start_time[task_id] = now
        
-    if (now - last_time) > 5 or current == total:
+    # Rendering is cheap and in-memory; the progress bus throttles the actual edits
+    if (now - last_time) > 1 or current == total:
         try:
             percentage = current * 100 / total
             speed = current / (now - progress.start_time[task_id]) if (now - progress.start_time[task_id]) > 0 else 0
@@ -223,8 +261,7 @@ def progress(current, total, message, type):
                 eta=TimeFormatter(eta * 1000)
             )
            
-            with open(f'{message.id}{type}status.txt', "w", encoding='utf-8') as fileup:
-                fileup.write(status)
+            progress_bus.publish(task_id, status)
                
             progress.cache[task_id] = now
            
@@ -233,6 +270,26 @@ def progress(current, total, message, type):
                 progress.cache.pop(task_id, None)
         except:
             pass
+def queued(message, task):
+    """Queue-position callback for the scheduler, shown on the task's status message."""
+    task_id = f"{message.id}{task}"
+    return lambda position: progress_bus.publish(task_id, script.QUEUED.format(position=position))
+async def send_size_limit(client, message):
+    btn = InlineKeyboardMarkup([[InlineKeyboardButton("💎 Upgrade to Premium", callback_data="buy_premium")]])
+    return await client.send_message(
+        message.chat.id,
+        script.SIZE_LIMIT,
+        reply_markup=btn,
+        parse_mode=enums.ParseMode.HTML
+    )
+async def send_limit_reached(message):
+    btn = InlineKeyboardMarkup([[InlineKeyboardButton("💎 Upgrade to Premium", callback_data="buy_premium")]])
+    return await message.reply_photo(
+        photo=SUBSCRIPTION,
+        caption=script.LIMIT_REACHED,
+        reply_markup=btn,
+        parse_mode=enums.ParseMode.HTML
+    )
 # ==============================================================================
 # 🎮 CORE COMMANDS
 # ==============================================================================
@@ -294,6 +351,8 @@ async def send_plan(client: Client, message: Message):
 @Client.on_message(filters.command(["cancel"]))
 async def send_cancel(client: Client, message: Message):
     batch_temp.IS_BATCH[message.from_user.id] = True
+    # Also stops jobs queued or running elsewhere, and keeps them from being resumed
+    await db.cancel_jobs(message.from_user.id)
     await message.reply_text("❌ Batch Process Cancelled Successfully.")
 # ==============================================================================
 # 🧩 SETTINGS PANEL (Upgraded UI)
@@ -327,22 +386,12 @@ async def settings_panel(client, callback_query):
 async def save(client: Client, message: Message):
     if "https://t.me/" in message.text:
        
-        # --- 1. GLOBAL LIMIT CHECK ---
-        # We check limit first for everyone (Public or Private)
-        is_limit_reached = await db.check_limit(message.from_user.id)
-        if is_limit_reached:
-            btn = InlineKeyboardMarkup([[InlineKeyboardButton("💎 Upgrade to Premium", callback_data="buy_premium")]])
-            return await message.reply_photo(
-                photo=SUBSCRIPTION,
-                caption=script.LIMIT_REACHED,
-                reply_markup=btn,
-                parse_mode=enums.ParseMode.HTML
-            )
-       
-        # --- 2. BATCH CONTROL ---
-        if batch_temp.IS_BATCH.get(message.from_user.id) == False:
+        # --- 1. BATCH CONTROL ---
+        # With WORKER_MODE ranges run in other processes, only the jobs collection knows
+        busy = await db.has_active_job(message.from_user.id) if WORKER_MODE else batch_temp.IS_BATCH.get(message.from_user.id) == False
+        if busy:
             return await message.reply_text("<b>⚠️ A Task is Currently Processing.</b>\n<i>Please wait for completion or use /cancel to stop.</i>", parse_mode=enums.ParseMode.HTML)
-        # --- 3. LINK PARSING ---
+        # --- 2. LINK PARSING ---
         datas = message.text.split("/")
         temp = datas[-1].replace("?single", "").split("-")
         fromID = int(temp[0].strip())
@@ -350,194 +399,589 @@ async def save(client: Client, message: Message):
             toID = int(temp[1].strip())
         except:
             toID = fromID
-        batch_temp.IS_BATCH[message.from_user.id] = False
+        if toID < fromID:
+            return await message.reply_text("<b>⚠️ Invalid Range.</b>\n<i>The first message ID must not be larger than the last one.</i>", parse_mode=enums.ParseMode.HTML)
+       
+        # --- 3. GLOBAL LIMIT CHECK ---
+        # Reserve quota for the whole range in one atomic round-trip (Public or Private)
+        quota = QuotaReservation(*await db.consume_quota(message.from_user.id, toID - fromID + 1, FREE_LIMIT_DAILY))
+        if quota.exhausted:
+            return await send_limit_reached(message)
         # Determine Link Type
         is_private_link = "https://t.me/c/" in message.text
         is_batch = "https://t.me/b/" in message.text
         is_public_link = not is_private_link and not is_batch
-        # --- 4. PROCESSING LOOP ---
-        for msgid in range(fromID, toID + 1):
-           
-            # Check Cancel Flag
-            if batch_temp.IS_BATCH.get(message.from_user.id):
-                break
-           
-            # ==================================================================
-            # 🟢 PATH A: PUBLIC LINK HANDLING (No Login Required)
-            # ==================================================================
-            if is_public_link:
-                username = datas[3]
-                try:
-                    # Attempt to Copy directly using Bot API
-                    # This is fast and requires NO login session
-                    await client.copy_message(
-                        chat_id=message.chat.id,
-                        from_chat_id=username,
-                        message_id=msgid,
-                        reply_to_message_id=message.id
+        if is_private_link:
+            chat_target = int("-100" + datas[4])
+        elif is_batch:
+            chat_target = datas[4]
+        else:
+            # Public links fall back to the user client when copying fails (Restricted Public)
+            chat_target = datas[3]
+        # --- 4. PERSIST & RUN ---
+        # The range is stored as a job first so a restart resumes it instead of losing it
+        job = await db.create_job(
+            message.from_user.id, message.chat.id, message.id, chat_target,
+            is_public_link, fromID, toID, quota.granted
+        )
+        if WORKER_MODE:
+            # A worker process claims it from the shared queue
+            return await message.reply_text(script.JOB_QUEUED, parse_mode=enums.ParseMode.HTML)
+        job = await db.claim_job(WORKER_ID, JOB_LEASE, job_id=job['_id'])
+        if job is None:
+            return  # Already picked up by the job poller
+        start_job(client, LeasedJob(job), message)
+def start_job(client: Client, leased, message: Message):
+    # Run off Pyrogram's handler workers: ranges waiting on the scheduler must not block updates
+    user_id = leased.job['user_id']
+    batch_temp.IS_BATCH[user_id] = False
+    batch_temp.JOBS[user_id] = leased
+    # Settings may have been changed through another process since they were cached here
+    db.forget_user(user_id)
+    leased.start()
+    batch_temp.TASKS[user_id] = asyncio.create_task(run_job(client, leased, message))
+async def run_job(client: Client, leased, message: Message):
+    """
+    Processes a claimed job's remaining messages concurrently, delivered in
+    range order, checkpointing every finished message.
+    """
+    job = leased.job
+    user_id = job['user_id']
+    chat_target = job['chat_target']
+    quota = QuotaReservation.restore(job['quota_granted'], job.get('quota_used', 0))
+    session = {"acc": None, "failed": False}
+    session_lock = asyncio.Lock()
+    public_copy = {"ok": job['public']}
+    range_staging = RangeStaging(staging)
+
+    async def get_acc():
+        # One pooled user client per range, connected by whichever item needs it first
+        async with session_lock:
+            if session["failed"]:
+                raise BatchAborted()
+            if session["acc"] is None:
+                user_data = await db.get_session(user_id)
+                if user_data is None:
+                    session["failed"] = True
+                    await message.reply(
+                        "<b>🔒 Authentication Required</b>\n\n"
+                        "<i>Access to this content requires login.</i>\n"
+                        "<i>Use /login to securely authorize your account.</i>",
+                        parse_mode=enums.ParseMode.HTML
                     )
-                    # Success! Count traffic and continue
-                    await db.add_traffic(message.from_user.id)
-                    await asyncio.sleep(1)
-                    continue
+                    raise BatchAborted()
+                try:
+                    # 🚀 SPEED UPGRADE: reuse the user's pooled connection
+                    session["acc"] = await user_pool.acquire(user_id, user_data)
                 except Exception as e:
-                    # If this fails, it might be a Restricted Content channel or Bot is banned
-                    # Fallback to Login Logic below
-                    pass
-            # ==================================================================
-            # 🟠 PATH B: PRIVATE / RESTRICTED HANDLING (Login Required)
-            # ==================================================================
-           
-            # 1. Check Session
-            user_data = await db.get_session(message.from_user.id)
-            if user_data is None:
-                await message.reply(
-                    "<b>🔒 Authentication Required</b>\n\n"
-                    "<i>Access to this content requires login.</i>\n"
-                    "<i>Use /login to securely authorize your account.</i>",
-                    parse_mode=enums.ParseMode.HTML
-                )
-                batch_temp.IS_BATCH[message.from_user.id] = True
+                    session["failed"] = True
+                    await message.reply(f"<b>❌ Authentication Failed</b>\n\n<i>Your session may have expired. Please /logout and /login again.</i>\n<code>{e}</code>", parse_mode=enums.ParseMode.HTML)
+                    raise BatchAborted()
+            return session["acc"]
+
+    async def deliver(seq, item, delivery, stage):
+        turn = lambda: delivery.wait_turn(seq)
+        # ==================================================================
+        # 🟢 PATH A: PUBLIC LINK HANDLING (No Login Required)
+        # ==================================================================
+        if public_copy["ok"] and item.msg is None:
+            # Reserve the unit first so concurrent items can't overshoot the quota
+            if not quota.take():
                 return
-            # 2. Connect User Client
             try:
-                # 🚀 SPEED UPGRADE ENABLED
-                acc = Client(
-                    "saverestricted",
-                    session_string=user_data,
-                    api_hash=API_HASH,
-                    api_id=API_ID,
-                    in_memory=True,
-                    max_concurrent_transmissions=10 # High speed
+                # Attempt to Copy directly using Bot API
+                # This is fast and requires NO login session
+                await turn()
+                copied = await bot_limiter.call(
+                    message.chat.id,
+                    client.copy_message,
+                    chat_id=message.chat.id,
+                    from_chat_id=chat_target,
+                    message_id=item.msgid,
+                    reply_to_message_id=message.id
                 )
-                await acc.connect()
+                # Only now is it certain nothing gets staged (a failed copy downloads instead)
+                await stage.skip()
+                await send_to_dump(client, message, copied)
+                return
+            except FloodWait:
+                # Still rate limited after the limiter's retries: fail this message only
+                quota.give_back()
+                raise
             except Exception as e:
-                batch_temp.IS_BATCH[message.from_user.id] = True
-                return await message.reply(f"<b>❌ Authentication Failed</b>\n\n<i>Your session may have expired. Please /logout and /login again.</i>\n<code>{e}</code>", parse_mode=enums.ParseMode.HTML)
-            # 3. Route to Handler
-            if is_private_link:
-                chatid = int("-100" + datas[4])
-                await handle_restricted_content(client, acc, message, chatid, msgid)
-            elif is_batch:
-                username = datas[4]
-                await handle_restricted_content(client, acc, message, username, msgid)
-            else:
-                # Fallback for failed public links (Restricted Public)
-                username = datas[3]
-                await handle_restricted_content(client, acc, message, username, msgid)
-            await asyncio.sleep(2) # Prevent floodwait
-        batch_temp.IS_BATCH[message.from_user.id] = True
+                quota.give_back()
+                # If this fails, it might be a Restricted Content channel or Bot is banned
+                # Fallback to Login Logic below (for the rest of the range too)
+                public_copy["ok"] = False
+        # ==================================================================
+        # 🟠 PATH B: PRIVATE / RESTRICTED HANDLING (Login Required)
+        # ==================================================================
+        acc = await get_acc()
+        if item.is_group:
+            await handle_media_group(client, acc, message, item, quota, turn, stage)
+        else:
+            await handle_restricted_content(client, acc, message, chat_target, item, quota, turn, stage)
+
+    async def process(seq, item, delivery):
+        # Every item passes its staging turn (or later items could never reserve
+        # disk) and gives back any reservation an error path left behind
+        stage = range_staging.item(seq)
+        if batch_temp.IS_BATCH.get(user_id) or leased.stopped:
+            return await stage.finish()
+        msgids = [m.msgid for m in item.members]
+        try:
+            await deliver(seq, item, delivery, stage)
+        except BatchAborted:
+            raise
+        except Exception:
+            await leased.record(seq, msgids, "failed", quota.used)
+            raise
+        finally:
+            await stage.finish()
+        await leased.record(seq, msgids, "done", quota.used)
+
+    # Message metadata is fetched 200 ids at a time, ahead of the transfers
+    prefetch = RangePrefetcher(
+        leased.pending_ids(), get_acc, chat_target, get_message_type, user_limiter(user_id),
+        enabled=lambda: not public_copy["ok"]
+    )
+    # Stop starting new messages on /cancel, once the reserved quota is used up,
+    # or when another worker took the job over
+    executor = BatchExecutor(
+        batch_workers(quota.granted is None),
+        should_stop=lambda: batch_temp.IS_BATCH.get(user_id) or quota.exhausted or leased.stopped
+    )
+    state = "failed"
+    try:
+        await executor.run(prefetch, process)
+        if batch_temp.IS_BATCH.get(user_id) or leased.cancelled:
+            state = "cancelled"
+        elif not executor.aborted:
+            state = "done"
+        if quota.exhausted and (executor.stopped_early or quota.denied) and state == "done":
+            await send_limit_reached(message)
+    except asyncio.CancelledError:
+        # Shutting down: hand the job back so it resumes elsewhere
+        state = None
+        raise
+    except Exception as e:
+        logger.error(f"Job {leased.id} ({job['from_id']}-{job['to_id']}) for {user_id} failed: {e}")
+    finally:
+        prefetch.close()
+        if session["acc"] is not None:
+            user_pool.release(user_id)
+        batch_temp.IS_BATCH[user_id] = True
+        batch_temp.TASKS.pop(user_id, None)
+        batch_temp.JOBS.pop(user_id, None)
+        shutil.rmtree(staging.job_dir(message), ignore_errors=True)
+        if state is None:
+            await leased.release()
+        else:
+            if not leased.lost:
+                # Give back whatever the range didn't use (empty/text messages, cancel)
+                await db.refund_quota(user_id, quota.unused)
+            await leased.finish(state)
+async def resume_jobs(client: Client):
+    """
+    Claims queued jobs and jobs whose lease expired (interrupted by a restart
+    or a dead worker) and runs them. Loops for the lifetime of the bot.
+    """
+    while True:
+        try:
+            await db.reap_dead_workers(JOB_LEASE)
+            while True:
+                busy = [uid for uid, running in batch_temp.IS_BATCH.items() if running == False]
+                job = await db.claim_job(WORKER_ID, JOB_LEASE, exclude_users=busy)
+                if job is None:
+                    break
+                leased = LeasedJob(job)
+                try:
+                    message = await client.get_messages(job['chat_id'], job['message_id'])
+                except Exception as e:
+                    message = None
+                    logger.warning(f"Could not load the request message of job {job['_id']}: {e}")
+                if message is None or message.empty:
+                    # Nothing of the range will run, give its reserved quota back
+                    await db.refund_quota(job['user_id'], QuotaReservation.restore(job['quota_granted'], job.get('quota_used', 0)).unused)
+                    await leased.finish("failed")
+                    continue
+                logger.info(f"Resuming job {job['_id']} for {job['user_id']} after id {leased.last_done}")
+                start_job(client, leased, message)
+        except Exception as e:
+            logger.error(f"Job poller error: {e}")
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+async def stop_jobs():
+    """Cancels this process's running jobs; each hands its lease back on the way out."""
+    tasks = list(batch_temp.TASKS.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
 # ==============================================================================
 # 📥 RESTRICTED CONTENT DOWNLOADER
 # ==============================================================================
-async def handle_restricted_content(client: Client, acc, message: Message, chat_target, msgid):
-    try:
-        msg: Message = await acc.get_messages(chat_target, msgid)
-    except Exception as e:
-        logger.error(f"Error fetching message: {e}")
-        return
-    if msg.empty:
-        return
-   
-    msg_type = get_message_type(msg)
+async def handle_restricted_content(client: Client, acc, message: Message, chat_target, job, quota, turn, stage):
+    # `turn` is awaited right before anything is sent, keeping the range's order;
+    # `stage` reserves disk for the download, also in range order
+    msgid = job.msgid
+    msg, msg_type = job.msg, job.msg_type
+    if msg is None:
+        # Not prefetched (public range that stopped copying, or a failed prefetch chunk)
+        try:
+            msg = await user_limiter(message.from_user.id).call(chat_target, acc.get_messages, chat_target, msgid)
+        except Exception as e:
+            logger.error(f"Error fetching message: {e}")
+            return
+        if msg.empty:
+            return
+        msg_type = get_message_type(msg)
     if not msg_type:
         return
     # --- SIZE LIMIT CHECK ---
-    file_size = 0
-    if msg_type == "Document": file_size = msg.document.file_size
-    elif msg_type == "Video": file_size = msg.video.file_size
-    elif msg_type == "Audio": file_size = msg.audio.file_size
+    file_size = get_file_size(msg, msg_type)
    
     # 2GB Limit for Free Users
     if file_size > FREE_LIMIT_SIZE:
         if not await db.check_premium(message.from_user.id):
-            btn = InlineKeyboardMarkup([[InlineKeyboardButton("💎 Upgrade to Premium", callback_data="buy_premium")]])
-            await client.send_message(
-                message.chat.id,
-                script.SIZE_LIMIT,
-                reply_markup=btn,
-                parse_mode=enums.ParseMode.HTML
-            )
+            await send_size_limit(client, message)
             return
     # --- TEXT HANDLING ---
     if msg_type == "Text":
         try:
-            await client.send_message(message.chat.id, msg.text, entities=msg.entities, parse_mode=enums.ParseMode.HTML)
+            await stage.skip()
+            await turn()
+            sent = await bot_limiter.call(message.chat.id, client.send_message, message.chat.id, msg.text, entities=msg.entities, parse_mode=enums.ParseMode.HTML)
+            await send_to_dump(client, message, sent)
             return
         except:
             return
     # --- INCREMENT COUNTER ---
-    await db.add_traffic(message.from_user.id)
-    # --- DOWNLOAD PROCESS ---
-    smsg = await client.send_message(message.chat.id, '<b>⬇️ Starting Download...</b>', reply_to_message_id=message.id, parse_mode=enums.ParseMode.HTML)
+    if not quota.take():
+        return
+    # --- CONTENT CACHE ---
+    # Media another save already uploaded is re-sent by file_id, no transfer at all
+    custom_thumb = await db.get_thumbnail(message.from_user.id)
+    # The staging turn is kept until the cached send succeeded, a stale file_id downloads
+    if not custom_thumb and await send_cached(client, message, msg, msg_type, file_size, turn):
+        return
+    # --- DISK STAGING ---
+    # Large media is relayed: streamed from the user client straight into the
+    # bot's upload, so the file never touches the disk. Anything else reserves
+    # its size first and waits while the disk budget is used up.
+    relay = can_relay(msg_type, file_size)
+    if relay:
+        await stage.skip()
+        return await transfer_media(client, acc, message, msg, msg_type, file_size, custom_thumb, relay, turn)
+    try:
+        reservation = await stage.reserve(file_size)
+    except InsufficientSpace as e:
+        quota.give_back()
+        logger.warning(f"Not staging {msgid} for {message.from_user.id}: {e}")
+        await bot_limiter.call(message.chat.id, client.send_message, message.chat.id, "<b>❌ This file is larger than the free disk space on the server.</b>", reply_to_message_id=message.id, parse_mode=enums.ParseMode.HTML)
+        return
+    async with reservation:
+        await transfer_media(client, acc, message, msg, msg_type, file_size, custom_thumb, relay, turn)
+async def transfer_media(client: Client, acc, message: Message, msg: Message, msg_type, file_size, custom_thumb, relay, turn):
+    """Downloads (or relays) one media message and uploads it to the requesting chat."""
+    msgid = msg.id
+    smsg = await bot_limiter.call(message.chat.id, client.send_message, message.chat.id, '<b>⚡ Starting Relay...</b>' if relay else '<b>⬇️ Starting Download...</b>', reply_to_message_id=message.id, parse_mode=enums.ParseMode.HTML)
    
-    # Create unique temp directory
-    temp_dir = f"downloads/{message.id}"
+    # Create unique temp directory (thumbnails only when relaying)
+    temp_dir = f"{staging.job_dir(message)}/{msgid}"
     if not os.path.exists(temp_dir): os.makedirs(temp_dir)
+    # Per-message progress ids, several messages of a range run at once
+    down_id, up_id = f"down{msgid}", f"up{msgid}"
+    # The user's delete/replace words apply to the saved file's name too
+    file_name = (await get_rewriter(message.from_user.id)).file_name(media_file_name(msg, msg_type))
+    if relay:
+        file = file_name
+    else:
+        progress_bus.attach(f"{message.id}{down_id}", client, message.chat.id, smsg.id)
+        try:
+            async with scheduler.downloads.slot(message.from_user.id, queued(message, down_id)):
+                if can_download_parallel(msg_type, file_size):
+                    # Large media: several concurrent range requests
+                    file = await download_parallel(
+                        acc, msg, msg_type,
+                        f"{temp_dir}/{file_name}",
+                        user_limiter(message.from_user.id),
+                        progress=progress,
+                        progress_args=[message, down_id]
+                    )
+                else:
+                    file = await acc.download_media(
+                        msg,
+                        file_name=f"{temp_dir}/{file_name}",
+                        progress=progress,
+                        progress_args=[message, down_id]
+                    )
+            # download_media returns None instead of raising on most errors
+            if file is None:
+                raise ConnectionError("Download failed")
+        except Exception as e:
+            if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
+            if batch_temp.IS_BATCH.get(message.from_user.id) or "Cancelled" in str(e):
+                return await smsg.edit("❌ **Task Cancelled**")
+            # Resumes are used up; the job records this message as failed
+            await smsg.delete()
+            raise
+        finally:
+            progress_bus.finish(f"{message.id}{down_id}")
+    # --- UPLOAD PROCESS ---
+    progress_bus.attach(f"{message.id}{up_id}", client, message.chat.id, smsg.id)
+    sent = None
     try:
-        asyncio.create_task(downstatus(client, f'{message.id}downstatus.txt', smsg, message.chat.id))
-       
-        file = await acc.download_media(
-            msg,
-            file_name=f"{temp_dir}/",
-            progress=progress,
-            progress_args=[message, "down"]
-        )
+        ph_path = await get_thumbnail_path(client, acc, message, msg, msg_type, temp_dir, None if relay else file)
+        final_caption = await build_caption(message, msg, file.split("/")[-1], file_size)
+        # Send File (disk uploads wait their turn; the relay uploads at once and only waits to send)
+        if relay:
+            async with scheduler.downloads.slot(message.from_user.id, queued(message, up_id)) as down_slot, \
+                    scheduler.uploads.slot(message.from_user.id, queued(message, up_id)) as up_slot:
+                async def before_send():
+                    # Transfer is done, don't hold global slots while waiting for our turn
+                    down_slot.release()
+                    up_slot.release()
+                    await turn()
+                # A video without any thumbnail gets a keyframe from the start of the stream
+                make_thumb = (lambda head: video_thumb_from_head(msg, head, temp_dir)) if msg_type == "Video" else None
+                sent = await relay_media(client, acc, msg, msg_type, message.chat.id, file, file_size, user_limiter(message.from_user.id), caption=final_caption, thumb=ph_path, make_thumb=make_thumb, progress=progress, progress_args=[message, up_id], before_send=before_send)
+        else:
+            await turn()
+            async with scheduler.uploads.slot(message.from_user.id, queued(message, up_id)):
+                if msg_type == "Document":
+                    sent = await bot_limiter.call_once(message.chat.id, client.send_document, message.chat.id, file, thumb=ph_path, caption=final_caption, progress=progress, progress_args=[message, up_id])
+                elif msg_type == "Video":
+                    sent = await bot_limiter.call_once(message.chat.id, client.send_video, message.chat.id, file, duration=msg.video.duration, width=msg.video.width, height=msg.video.height, thumb=ph_path, caption=final_caption, progress=progress, progress_args=[message, up_id])
+                elif msg_type == "Audio":
+                    sent = await bot_limiter.call_once(message.chat.id, client.send_audio, message.chat.id, file, thumb=ph_path, caption=final_caption, progress=progress, progress_args=[message, up_id])
+                elif msg_type == "Photo":
+                    sent = await bot_limiter.call_once(message.chat.id, client.send_photo, message.chat.id, file, caption=final_caption)
        
-        if os.path.exists(f'{message.id}downstatus.txt'): os.remove(f'{message.id}downstatus.txt')
     except Exception as e:
+        if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
         if batch_temp.IS_BATCH.get(message.from_user.id) or "Cancelled" in str(e):
-            if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
             return await smsg.edit("❌ **Task Cancelled**")
-        return await smsg.delete()
-    # --- UPLOAD PROCESS ---
+        await smsg.edit(f"Upload Failed: {e}")
+        raise
+    finally:
+        progress_bus.finish(f"{message.id}{up_id}")
+    # Remember our upload for the next save of the same media (custom thumbs are per user)
+    if sent is not None and not custom_thumb:
+        await remember_upload(msg, msg_type, sent, file_name)
+    await send_to_dump(client, message, sent)
+    # Final Cleanup
+    if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
+    await bot_limiter.call(message.chat.id, client.delete_messages, message.chat.id, [smsg.id])
+# ==============================================================================
+# 🖼️ MEDIA GROUP (ALBUM) SAVER
+# ==============================================================================
+async def handle_media_group(client: Client, acc, message: Message, job, quota, turn, stage):
+    """
+    Saves an album as one send_media_group call. Members are downloaded
+    concurrently; ones already in the content cache are sent by file_id.
+    """
+    members = []
+    too_big = False
+    is_premium = await db.check_premium(message.from_user.id)
+    for member in job.members:
+        if get_file_size(member.msg, member.msg_type) > FREE_LIMIT_SIZE and not is_premium:
+            too_big = True
+            continue
+        if not quota.take():
+            break
+        members.append(member)
+    if too_big:
+        await send_size_limit(client, message)
+    if len(members) < 2:
+        # Nothing left to group, send what remains as a normal message
+        if members:
+            quota.give_back()
+            await handle_restricted_content(client, acc, message, members[0].msg.chat.id, members[0], quota, turn, stage)
+        return
+
+    custom_thumb = await db.get_thumbnail(message.from_user.id)
+    rewrite = await get_rewriter(message.from_user.id)
+    names = {m.msgid: rewrite.file_name(media_file_name(m.msg, m.msg_type)) for m in members}
+    cached = {}
+    if not custom_thumb:
+        for member in members:
+            hit = await db.get_cached_media(getattr(member.msg, member.msg_type.lower()).file_unique_id, names[member.msgid])
+            if hit:
+                cached[member.msgid] = hit['file_id']
+
+    # Reserve disk for every member that has to be downloaded
     try:
-        asyncio.create_task(upstatus(client, f'{message.id}upstatus.txt', smsg, message.chat.id))
-       
-        # 1. Custom Thumbnail (Priority)
-        ph_path = None
-        thumb_id = await db.get_thumbnail(message.from_user.id)
-       
-        if thumb_id:
-            try:
-                # Download Custom Thumb from Telegram Servers (Bot Client)
-                # We save it as "custom_thumb.jpg" to avoid conflict
-                ph_path = await client.download_media(thumb_id, file_name=f"{temp_dir}/custom_thumb.jpg")
-            except Exception as e:
-                logger.error(f"Failed to download custom thumb: {e}")
-        # 2. Original Thumbnail (Fallback)
-        if not ph_path:
+        reservation = await stage.reserve(sum(get_file_size(m.msg, m.msg_type) for m in members if m.msgid not in cached))
+    except InsufficientSpace as e:
+        for _ in members:
+            quota.give_back()
+        logger.warning(f"Not staging album {job.media_group_id} for {message.from_user.id}: {e}")
+        await bot_limiter.call(message.chat.id, client.send_message, message.chat.id, "<b>❌ This album is larger than the free disk space on the server.</b>", reply_to_message_id=message.id, parse_mode=enums.ParseMode.HTML)
+        return
+    temp_dir = f"{staging.job_dir(message)}/{job.msgid}"
+    smsg = await bot_limiter.call(message.chat.id, client.send_message, message.chat.id, f'<b>⬇️ Downloading Album ({len(members)} Files)...</b>', reply_to_message_id=message.id, parse_mode=enums.ParseMode.HTML)
+    progress_bus.attach(f"{message.id}album{job.msgid}", client, message.chat.id, smsg.id)
+    files = {}
+    extra = None
+    try:
+        for attempt in range(2):
+            fresh = [m for m in members if m.msgid not in cached and m.msgid not in files]
+            if fresh:
+                async with scheduler.downloads.slot(message.from_user.id, queued(message, f"album{job.msgid}")):
+                    paths = await asyncio.gather(*[download_album_member(acc, message, m, f"{temp_dir}/{m.msgid}", names[m.msgid]) for m in fresh])
+            else:
+                paths = []
+            files.update(zip([m.msgid for m in fresh], paths))
+            media = []
+            for m in members:
+                source = cached.get(m.msgid) or files[m.msgid]
+                caption = await build_caption(message, m.msg, names[m.msgid], get_file_size(m.msg, m.msg_type))
+                thumb = None if m.msgid in cached else await get_thumbnail_path(client, acc, message, m.msg, m.msg_type, f"{temp_dir}/{m.msgid}", source)
+                media.append(album_media(m.msg, m.msg_type, source, caption, thumb))
+            await turn()
             try:
-                if msg_type == "Video" and msg.video.thumbs:
-                    ph_path = await acc.download_media(msg.video.thumbs[0].file_id, file_name=f"{temp_dir}/thumb.jpg")
-                elif msg_type == "Document" and msg.document.thumbs:
-                    ph_path = await acc.download_media(msg.document.thumbs[0].file_id, file_name=f"{temp_dir}/thumb.jpg")
-            except:
-                pass
-        # Custom Caption
-        custom_caption = await db.get_caption(message.from_user.id)
-        if custom_caption:
-            final_caption = custom_caption.format(filename=file.split("/")[-1], size=humanbytes(file_size))
+                async with scheduler.uploads.slot(message.from_user.id, queued(message, f"album{job.msgid}")):
+                    sent = await bot_limiter.call_once(message.chat.id, client.send_media_group, message.chat.id, media)
+            except (FileIdInvalid, FileReferenceExpired, FileReferenceInvalid, MediaEmpty) as e:
+                if not cached or attempt:
+                    raise
+                # A cached file_id went stale: forget them all and upload the album fresh
+                logger.info(f"Stale cached file_id in album {job.media_group_id}, re-uploading: {e}")
+                # Cached members weren't reserved for; their downloads must fit right now
+                extra = staging.try_reserve(sum(get_file_size(m.msg, m.msg_type) for m in members if m.msgid in cached))
+                if extra is None:
+                    raise InsufficientSpace("Stale cached album members don't fit the staging budget")
+                for m in members:
+                    if m.msgid in cached:
+                        await db.drop_cached_media(getattr(m.msg, m.msg_type.lower()).file_unique_id)
+                cached = {}
+                continue
+            break
+    except Exception as e:
+        if batch_temp.IS_BATCH.get(message.from_user.id) or "Cancelled" in str(e):
+            return await smsg.edit("❌ **Task Cancelled**")
+        await smsg.edit(f"Upload Failed: {e}")
+        raise
+    finally:
+        progress_bus.finish(f"{message.id}album{job.msgid}")
+        if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
+        reservation.release()
+        if extra:
+            extra.release()
+
+    if not custom_thumb:
+        for m, s in zip(members, sent):
+            if m.msgid not in cached:
+                await remember_upload(m.msg, m.msg_type, s, names[m.msgid])
+    await send_to_dump(client, message, sent)
+    await bot_limiter.call(message.chat.id, client.delete_messages, message.chat.id, [smsg.id])
+async def download_album_member(acc, message: Message, member, temp_dir, file_name):
+    os.makedirs(temp_dir, exist_ok=True)
+    # Progress isn't shown per member, the callback still makes /cancel work
+    if can_download_parallel(member.msg_type, get_file_size(member.msg, member.msg_type)):
+        return await download_parallel(
+            acc, member.msg, member.msg_type,
+            f"{temp_dir}/{file_name}",
+            user_limiter(message.from_user.id),
+            progress=progress,
+            progress_args=[message, f"down{member.msgid}"]
+        )
+    path = await acc.download_media(
+        member.msg,
+        file_name=f"{temp_dir}/{file_name}",
+        progress=progress,
+        progress_args=[message, f"down{member.msgid}"]
+    )
+    if path is None:
+        raise ConnectionError("Download failed")
+    return path
+def album_media(msg: Message, msg_type, media, caption, thumb):
+    if msg_type == "Photo":
+        return InputMediaPhoto(media, caption=caption)
+    if msg_type == "Video":
+        return InputMediaVideo(media, thumb=thumb, caption=caption, duration=msg.video.duration, width=msg.video.width, height=msg.video.height, supports_streaming=True)
+    if msg_type == "Audio":
+        return InputMediaAudio(media, thumb=thumb, caption=caption)
+    return InputMediaDocument(media, thumb=thumb, caption=caption)
+async def send_cached(client: Client, message: Message, msg: Message, msg_type, file_size, turn):
+    """Re-sends media from the content cache. Returns False if it isn't cached or the file_id went stale."""
+    media = getattr(msg, msg_type.lower())
+    # Only an upload made under the same (rewritten) file name can be re-sent
+    file_name = (await get_rewriter(message.from_user.id)).file_name(media_file_name(msg, msg_type))
+    cached = await db.get_cached_media(media.file_unique_id, file_name)
+    if not cached:
+        return False
+    final_caption = await build_caption(message, msg, file_name, file_size)
+    await turn()
+    try:
+        sent = await bot_limiter.call(message.chat.id, client.send_cached_media, message.chat.id, cached['file_id'], caption=final_caption)
+    except (FileIdInvalid, FileReferenceExpired, FileReferenceInvalid, MediaEmpty, ValueError) as e:
+        logger.info(f"Stale cached file_id for {media.file_unique_id}, re-uploading: {e}")
+        await db.drop_cached_media(media.file_unique_id)
+        return False
+    await send_to_dump(client, message, sent)
+    return True
+async def send_to_dump(client: Client, message: Message, sent):
+    """
+    Copies a delivered message (or album) into the user's dump chat. Only the
+    file_id travels, the bytes are never uploaded a second time.
+    """
+    if not sent:
+        return
+    dump_chat = await db.get_dump_chat(message.from_user.id)
+    if not dump_chat or dump_chat == message.chat.id:
+        return
+    try:
+        if isinstance(sent, list):
+            await bot_limiter.call(dump_chat, client.copy_media_group, dump_chat, message.chat.id, sent[0].id)
         else:
-            final_caption = script.CAPTION.format(file_name=file.split("/")[-1])
-            if msg.caption:
-                final_caption += f"\n\n{msg.caption}"
-        # Send File
-        if msg_type == "Document":
-            await client.send_document(message.chat.id, file, thumb=ph_path, caption=final_caption, progress=progress, progress_args=[message, "up"])
-        elif msg_type == "Video":
-            await client.send_video(message.chat.id, file, duration=msg.video.duration, width=msg.video.width, height=msg.video.height, thumb=ph_path, caption=final_caption, progress=progress, progress_args=[message, "up"])
-        elif msg_type == "Audio":
-            await client.send_audio(message.chat.id, file, thumb=ph_path, caption=final_caption, progress=progress, progress_args=[message, "up"])
-        elif msg_type == "Photo":
-            await client.send_photo(message.chat.id, file, caption=final_caption)
-       
+            await bot_limiter.call(dump_chat, client.copy_message, dump_chat, message.chat.id, sent.id)
     except Exception as e:
-         await smsg.edit(f"Upload Failed: {e}")
-    # Final Cleanup
-    if os.path.exists(f'{message.id}upstatus.txt'): os.remove(f'{message.id}upstatus.txt')
-    if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
-    await client.delete_messages(message.chat.id, [smsg.id])
+        logger.warning(f"Copy to dump chat {dump_chat} of {message.from_user.id} failed: {e}")
+async def remember_upload(msg: Message, msg_type, sent: Message, file_name):
+    media = getattr(sent, msg_type.lower(), None)
+    if media is None:
+        return
+    try:
+        await db.cache_media(msg.chat.id, msg.id, getattr(msg, msg_type.lower()).file_unique_id, media.file_id, msg_type, file_name)
+    except Exception as e:
+        logger.warning(f"Failed to cache file_id for {msg.chat.id}/{msg.id}: {e}")
+async def get_thumbnail_path(client: Client, acc, message: Message, msg: Message, msg_type, temp_dir, file=None):
+    # 1. Custom Thumbnail (Priority)
+    ph_path = None
+    thumb_id = await db.get_thumbnail(message.from_user.id)
+   
+    if thumb_id:
+        try:
+            # Custom Thumb is fetched once (Bot Client), then served from the local cache
+            ph_path = await thumb_cache.get(client, thumb_id)
+        except Exception as e:
+            logger.error(f"Failed to download custom thumb: {e}")
+    # 2. Original Thumbnail (Fallback)
+    if not ph_path:
+        try:
+            if msg_type == "Video" and msg.video.thumbs:
+                ph_path = await acc.download_media(msg.video.thumbs[0].file_id, file_name=f"{temp_dir}/thumb.jpg")
+            elif msg_type == "Document" and msg.document.thumbs:
+                ph_path = await acc.download_media(msg.document.thumbs[0].file_id, file_name=f"{temp_dir}/thumb.jpg")
+        except:
+            pass
+    # 3. Keyframe of the downloaded video (no thumbnail anywhere)
+    if not ph_path and msg_type == "Video" and file:
+        try:
+            ph_path = await video_thumb(msg, file)
+        except Exception as e:
+            logger.warning(f"Failed to generate video thumb: {e}")
+    return ph_path
+async def build_caption(message: Message, msg: Message, file_name, file_size):
+    # `file_name` is already rewritten; the source caption is rewritten here
+    custom_caption = await db.get_caption(message.from_user.id)
+    if custom_caption:
+        return custom_caption.format(filename=file_name, size=humanbytes(file_size))
+    final_caption = script.CAPTION.format(file_name=file_name)
+    if msg.caption:
+        rewrite = await get_rewriter(message.from_user.id)
+        final_caption += f"\n\n{rewrite(msg.caption)}"
+    return final_caption
 # ==============================================================================
 # 🖱️ CALLBACK QUERY HANDLER (Upgraded Buttons)
 # ==============================================================================
@@ -646,8 +1090,13 @@ User ID: <code>{user_id}</code>
             parse_mode=enums.ParseMode.HTML
         )
     elif data == "dump_chat_btn":
-        text = """<b>🗑 Dump Chat Settings</b>
-This feature is under development."""
+        current = await db.get_dump_chat(callback_query.from_user.id)
+        where = f"<code>{current}</code>" if current else "Not set"
+        text = f"""<b>🗑 Dump Chat Settings</b>
+Current Dump Chat: {where}
+Every saved file is also copied there (no second upload).
+- /setchat chat_id: Set the dump chat
+- /setchat clear: Remove it"""
         buttons = [[InlineKeyboardButton("⬅️ Back to Settings", callback_data="settings_btn")]]
         await client.edit_message_caption(
             chat_id=message.chat.id,
@@ -669,6 +1118,7 @@ This feature is under development."""
 @Client.on_message(filters.photo & filters.private)
 async def set_thumbnail_handler(client: Client, message: Message):
     if settings_temp.STATE.get(message.from_user.id) == "thumb":
+        thumb_cache.invalidate(await db.get_thumbnail(message.from_user.id))
         await db.set_thumbnail(message.from_user.id, message.photo.file_id)
         settings_temp.STATE.pop(message.from_user.id, None)
         await message.reply_text("✅ Custom thumbnail set successfully.")
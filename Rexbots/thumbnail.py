@@ -1,6 +1,7 @@
 from pyrogram import Client, filters, enums
 from pyrogram.types import Message
 from database.db import db
+from Rexbots.thumbs import thumb_cache
 
 # ======================================================
 # /set_thumb - Set Custom Thumbnail (Reply to Photo)
@@ -25,6 +26,7 @@ async def set_custom_thumbnail(client: Client, message: Message):
     # 3. Save File ID to Database (NOT Path)
     # This ensures it works even if the bot restarts
     file_id = message.reply_to_message.photo.file_id
+    thumb_cache.invalidate(await db.get_thumbnail(user_id))
     await db.set_thumbnail(user_id, file_id)
 
     await message.reply_photo(
@@ -88,8 +90,9 @@ async def delete_custom_thumbnail(client: Client, message: Message):
             parse_mode=enums.ParseMode.HTML
         )
 
-    # Remove from DB
+    # Remove from DB and the local thumbnail cache
     await db.del_thumbnail(user_id)
+    thumb_cache.invalidate(thumb_id)
 
     await message.reply_text(
         "<b>🗑 Custom Thumbnail Deleted</b>\n\n"
@@ -0,0 +1,202 @@
+# Rexbots
+# Don't Remove Credit
+# Telegram Channel @RexBots_Official
+
+import asyncio
+import hashlib
+import os
+import shutil
+from collections import OrderedDict
+
+from pyrogram.file_id import FileId, FileUniqueId, FileUniqueType
+
+from config import THUMB_CACHE_MB, VIDEO_THUMBS
+from logger import LOGGER
+
+logger = LOGGER(__name__)
+
+# ==============================================================================
+# 🖼️ THUMBNAIL CACHE
+# Custom thumbnails are fetched once and kept on disk, keyed by the photo's
+# file_unique_id, instead of being re-downloaded for every upload. Videos
+# without a thumbnail get one cut locally by ffmpeg, cached the same way.
+# ==============================================================================
+THUMB_CACHE_DIR = "thumb_cache"
+THUMB_SIZE = 320            # Telegram's max thumbnail width/height
+FFMPEG_TIMEOUT = 30         # Seconds before a thumbnail extraction is abandoned
+_ffmpeg_slots = asyncio.Semaphore(os.cpu_count() or 1)
+
+
+def thumb_key(file_id):
+    """file_unique_id of a stored thumbnail file_id (the same photo always maps to one key)."""
+    try:
+        media_id = FileId.decode(file_id).media_id
+        return FileUniqueId(file_unique_type=FileUniqueType.DOCUMENT, media_id=media_id).encode()
+    except Exception:
+        return hashlib.sha1(file_id.encode()).hexdigest()
+
+
+class ThumbnailCache(object):
+    """
+    Size-bounded on-disk LRU of thumbnails. get() downloads a thumbnail on the
+    first miss only; concurrent misses for the same key share one download.
+    """
+
+    def __init__(self, root=THUMB_CACHE_DIR, max_bytes=THUMB_CACHE_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries = None  # key -> size (LRU order), loaded from disk on first use
+        self._locks = {}
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.jpg")
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        files = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.endswith(".jpg"):
+                # Leftover of an interrupted download
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name[:-4], stat.st_size))
+        self._entries = OrderedDict((key, size) for _, key, size in sorted(files))
+
+    async def get(self, client, file_id):
+        """Local path of the thumbnail, downloading it with `client` if it isn't cached."""
+        return await self.get_or_make(
+            thumb_key(file_id),
+            lambda part: client.download_media(file_id, file_name=part)
+        )
+
+    async def get_or_make(self, key, make):
+        """
+        Cached path for `key`. On a miss `make(part_path)` creates the file and
+        returns its path (or None on failure, which returns None too).
+        """
+        self._load()
+        path = self._path(key)
+        if key in self._entries and os.path.exists(path):
+            self._entries.move_to_end(key)
+            return path
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                if key not in self._entries or not os.path.exists(path):
+                    part = await make(f"{path}.{os.getpid()}.part")
+                    if not part:
+                        return None
+                    os.replace(part, path)
+                    self._entries[key] = os.path.getsize(path)
+                    self._evict(keep=key)
+                self._entries.move_to_end(key)
+        finally:
+            if not lock.locked():
+                self._locks.pop(key, None)
+        return path
+
+    def invalidate(self, file_id):
+        """Drops a thumbnail, e.g. when the user replaces or deletes it."""
+        if not file_id:
+            return
+        self._load()
+        key = thumb_key(file_id)
+        self._entries.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep):
+        total = sum(self._entries.values())
+        for key in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self._entries.pop(key)
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+
+thumb_cache = ThumbnailCache()
+
+
+def can_make_video_thumb():
+    return VIDEO_THUMBS and shutil.which("ffmpeg") is not None
+
+
+async def extract_keyframe(src, dst, duration=0, available=None):
+    """
+    Writes a JPEG of the first keyframe after ~10% of the video (max 10s in),
+    scaled to fit THUMB_SIZE. ffmpeg runs as a separate process, so decoding
+    never blocks the event loop. `available` is the seconds `src` holds when
+    it is only the start of the video. Returns `dst`, or None on failure.
+    """
+    offset = min(10, (duration or 0) / 10)
+    if available is not None:
+        offset = min(offset, available / 2)
+    args = [
+        "ffmpeg", "-v", "error", "-y",
+        "-ss", f"{offset:.2f}", "-skip_frame", "nokey", "-i", src,
+        "-frames:v", "1",
+        "-vf", f"scale={THUMB_SIZE}:{THUMB_SIZE}:force_original_aspect_ratio=decrease",
+        "-q:v", "5", "-f", "image2", dst
+    ]
+    async with _ffmpeg_slots:
+        proc = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+        try:
+            _, err = await asyncio.wait_for(proc.communicate(), FFMPEG_TIMEOUT)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            logger.warning(f"Thumbnail extraction timed out for {src}")
+            return None
+    if proc.returncode != 0 or not os.path.exists(dst) or not os.path.getsize(dst):
+        logger.debug(f"Thumbnail extraction failed for {src}: {err.decode(errors='ignore').strip()}")
+        return None
+    return dst
+
+
+async def video_thumb(msg, file):
+    """Locally generated thumbnail for a downloaded video, cached by its file_unique_id."""
+    if not can_make_video_thumb():
+        return None
+    return await thumb_cache.get_or_make(
+        f"video_{msg.video.file_unique_id}",
+        lambda part: extract_keyframe(file, part, msg.video.duration)
+    )
+
+
+def _write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+async def video_thumb_from_head(msg, head, temp_dir):
+    """
+    video_thumb() for a relayed video, which never lands on disk: the keyframe
+    is cut from its first bytes (enough when the container's index is at the
+    start, as in streamable MP4/MKV), staged in a small temp file.
+    """
+    if not can_make_video_thumb() or not head:
+        return None
+    # Seconds of video the head holds, assuming a roughly constant bitrate
+    available = (msg.video.duration or 0) * len(head) / max(len(head), msg.video.file_size or 0)
+
+    async def make(part):
+        os.makedirs(temp_dir, exist_ok=True)
+        src = os.path.join(temp_dir, "head")
+        await asyncio.to_thread(_write_file, src, head)
+        try:
+            return await extract_keyframe(src, part, msg.video.duration, available)
+        finally:
+            os.remove(src)
+
+    return await thumb_cache.get_or_make(f"video_{msg.video.file_unique_id}", make)
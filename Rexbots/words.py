@@ -29,24 +29,26 @@ async def rem_del_word(client: Client, message: Message):
 
 @Client.on_message(filters.command("set_repl_word") & filters.private)
 async def set_repl_word(client: Client, message: Message):
-    # Syntax: /set_repl_word target replacement
-    if len(message.command) < 3:
-        return await message.reply_text("**Usage:** `/set_repl_word target replacement`\n\nExample: `/set_repl_word @OldChannel @NewChannel`")
+    # Syntax: /set_repl_word target replacement [target2 replacement2 ...]
+    args = message.command[1:]
+    if len(args) < 2 or len(args) % 2:
+        return await message.reply_text("**Usage:** `/set_repl_word target replacement [target2 replacement2 ...]`\n\nExample: `/set_repl_word @OldChannel @NewChannel old.site new.site`")
     
-    target = message.command[1]
-    replacement = message.command[2]
-    
-    await db.set_replace_words(message.from_user.id, {target: replacement})
-    await message.reply_text(f"**Set replacement:** `{target}` -> `{replacement}`")
+    pairs = dict(zip(args[0::2], args[1::2]))
+    await db.set_replace_words(message.from_user.id, pairs)
+    if len(pairs) == 1:
+        target, replacement = next(iter(pairs.items()))
+        return await message.reply_text(f"**Set replacement:** `{target}` -> `{replacement}`")
+    await message.reply_text(f"**Set {len(pairs)} replacements:**\n" + "\n".join(f"`{t}` -> `{r}`" for t, r in pairs.items()))
 
 @Client.on_message(filters.command("rem_repl_word") & filters.private)
 async def rem_repl_word(client: Client, message: Message):
     if len(message.command) < 2:
-         return await message.reply_text("**Usage:** `/rem_repl_word target`")
+         return await message.reply_text("**Usage:** `/rem_repl_word target [target2 ...]`")
     
-    target = message.command[1]
-    await db.remove_replace_words(message.from_user.id, [target])
-    await message.reply_text(f"**Removed replacement for:** `{target}`")
+    targets = message.command[1:]
+    await db.remove_replace_words(message.from_user.id, targets)
+    await message.reply_text("**Removed replacement for:** " + ", ".join(f"`{t}`" for t in targets))
 
 # Rexbots
 # Don't Remove Credit
@@ -7,9 +7,14 @@ from datetime import timezone, timedelta
 from pyrogram import Client, filters, enums, __version__ as pyrogram_version
 from pyrogram.types import Message
 
-from config import API_ID, API_HASH, BOT_TOKEN, LOG_CHANNEL
+from config import API_ID, API_HASH, BOT_TOKEN, LOG_CHANNEL, WORKER_MODE
 from database.db import db
 from logger import LOGGER
+from Rexbots.client_pool import user_pool
+from Rexbots.ratelimit import LimitedInvoke
+from Rexbots.broadcast import resume_broadcasts
+from Rexbots.start import resume_jobs, stop_jobs
+from Rexbots.staging import staging
 
 # ✅ Keep-alive server (For Render / Heroku)
 try:
@@ -39,7 +44,7 @@ LOGO = r"""
     𝙱𝙾𝚃 𝚆𝙾𝚁𝙺𝙸𝙽𝙶 𝙿𝚁𝙾𝙿𝙴𝚁𝙻𝚈....
 """
 
-class Bot(Client):
+class Bot(LimitedInvoke, Client):
     def __init__(self):
         super().__init__(
             name="Rexbots_Login_Bot",
@@ -52,7 +57,7 @@ class Bot(Client):
             # 🚀 SPEED & PERFORMANCE UPGRADES (Safe Radar)
             # ==================================================================
             workers=10,                        # Max concurrent tasks
-            sleep_threshold=15,                 # Auto-sleep on FloodWait
+            sleep_threshold=15,                 # Auto-sleep on FloodWait (raised to bot_limiter on its calls)
             max_concurrent_transmissions=10,    # ⚡ Upload Speed Boost (10x)
             ipv6=False,                         # Disable IPv6 for stability
             in_memory=False,                    # Keep session on disk
@@ -75,6 +80,19 @@ class Bot(Client):
             except Exception as e:
                 logger.warning(f"Keep-alive failed to start: {e}")
 
+        # 🔹 Ensure indexes & verify hot query plans
+        try:
+            await db.ensure_indexes()
+            await db.check_query_plans()
+        except Exception as e:
+            logger.error(f"Index setup failed: {e}")
+
+        # 🔹 Escape replace words stored by older versions
+        try:
+            await db.migrate_replace_words()
+        except Exception as e:
+            logger.error(f"Replace words migration failed: {e}")
+
         # 🔹 Log DB stats
         user_count = await db.total_users_count()
         logger.info(f"Connected to MongoDB Database: {db.db.name}")
@@ -115,6 +133,22 @@ class Bot(Client):
         except Exception as e:
             logger.error(f"Failed to send startup log: {e}")
 
+        # 🔹 Resume broadcasts interrupted by a restart
+        try:
+            await resume_broadcasts(self)
+        except Exception as e:
+            logger.error(f"Failed to resume broadcasts: {e}")
+
+        # 🔹 Sweep downloads left behind by a crash, before any job stages new ones
+        try:
+            staging.sweep()
+        except Exception as e:
+            logger.warning(f"Download sweep failed: {e}")
+
+        # 🔹 Resume save jobs interrupted by a restart (keeps polling for orphaned ones)
+        # With WORKER_MODE the worker.py processes run them instead
+        self.job_poller = None if WORKER_MODE else asyncio.create_task(resume_jobs(self))
+
         logger.info(f"Bot running as @{me.username}")
 
     async def stop(self, *args):
@@ -137,6 +171,14 @@ class Bot(Client):
         except Exception as e:
             logger.error(f"Failed to send stop log: {e}")
 
+        # 🔹 Stop claiming jobs; running ones are resumed after the lease expires
+        if getattr(self, "job_poller", None):
+            self.job_poller.cancel()
+        await stop_jobs()
+
+        # 🔹 Disconnect pooled user clients
+        await user_pool.close_all()
+
         await super().stop()
         logger.info("Bot stopped cleanly")
 
@@ -15,6 +15,36 @@ DB_NAME = os.environ.get("DB_NAME", "")
 LOG_CHANNEL = -1003656791142
 ERROR_MESSAGE = bool(os.environ.get('ERROR_MESSAGE', True))
 KEEP_ALIVE_URL = os.environ.get("KEEP_ALIVE_URL", "")
+FREE_DAILY_LIMIT = int(os.environ.get("FREE_DAILY_LIMIT", 10))        # Saves per 24h for free users
+USER_POOL_SIZE = int(os.environ.get("USER_POOL_SIZE", 50))            # Max connected user clients
+USER_IDLE_TIMEOUT = int(os.environ.get("USER_IDLE_TIMEOUT", 600))     # Seconds before an idle user client is closed
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 300))           # Seconds a cached user document stays fresh
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 5000))        # Max cached user documents
+BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", 20))      # Concurrent broadcast senders
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", 25))          # Broadcast messages per second (bot limit ~30/s)
+RELAY_MODE = os.environ.get("RELAY_MODE", "True").lower() in ("true", "1", "yes")  # Stream large files without staging on disk
+RELAY_BUFFER_MB = int(os.environ.get("RELAY_BUFFER_MB", 8))           # In-memory relay buffer per transfer (1 MB chunks)
+DOWNLOAD_CONNECTIONS = int(os.environ.get("DOWNLOAD_CONNECTIONS", 4)) # Concurrent range requests per large file (1 = off)
+BATCH_FREE_WORKERS = int(os.environ.get("BATCH_FREE_WORKERS", 2))      # Messages in flight per free user's range
+BATCH_PREMIUM_WORKERS = int(os.environ.get("BATCH_PREMIUM_WORKERS", 5))  # Messages in flight per premium user's range
+BATCH_GLOBAL_WORKERS = int(os.environ.get("BATCH_GLOBAL_WORKERS", 20))   # Messages in flight across all users
+MEDIA_CACHE_DAYS = int(os.environ.get("MEDIA_CACHE_DAYS", 30))          # Days a cached file_id is reused before re-uploading
+MAX_DOWNLOADS = int(os.environ.get("MAX_DOWNLOADS", 10))                # Concurrent downloads across all users
+MAX_UPLOADS = int(os.environ.get("MAX_UPLOADS", 10))                    # Concurrent uploads across all users
+PREMIUM_WEIGHT = int(os.environ.get("PREMIUM_WEIGHT", 3))               # Premium slots granted per free slot when both wait
+JOB_LEASE = int(os.environ.get("JOB_LEASE", 60))                        # Seconds a save job stays claimed without a heartbeat
+WORKER_MODE = os.environ.get("WORKER_MODE", "False").lower() in ("true", "1", "yes")  # Save jobs run in worker.py processes, not the bot
+WORKERS = int(os.environ.get("WORKERS", 2))                             # Worker processes started by worker.py
+BOT_RATE = float(os.environ.get("BOT_RATE", 25))                        # Bot API calls per second across all chats
+CHAT_RATE = float(os.environ.get("CHAT_RATE", 1))                       # Bot messages per second into a single chat
+USER_RATE = float(os.environ.get("USER_RATE", 10))                      # API calls per second per logged-in user client
+THUMB_CACHE_MB = int(os.environ.get("THUMB_CACHE_MB", 20))              # Disk space (MB) for cached custom and generated thumbnails
+VIDEO_THUMBS = os.environ.get("VIDEO_THUMBS", "True").lower() in ("true", "1", "yes")  # Cut a thumbnail with ffmpeg for videos that have none
+STAGING_MB = int(os.environ.get("STAGING_MB", 0))                       # Disk budget (MB) for downloads in progress, 0 = 90% of free space
+# With WORKER_MODE every process has its own limiters, so limits across all users are split between them
+TRANSFER_PROCESSES = max(1, WORKERS) if WORKER_MODE else 1              # Processes running save jobs (workers only)
+SENDING_PROCESSES = max(1, WORKERS) + 1 if WORKER_MODE else 1           # Processes sending as the bot (workers + bot)
+CHAT_SENDERS = 2 if WORKER_MODE else 1                                  # The bot process and the one worker running the user's job
 # Rexbots
 # Don't Remove Credit
 # Telegram Channel @RexBots_Official
@@ -1,16 +1,159 @@
 import motor.motor_asyncio
 import datetime
-from config import DB_NAME, DB_URI
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+import re
+import time
+from collections import OrderedDict
+from config import DB_NAME, DB_URI, USER_CACHE_TTL, USER_CACHE_SIZE, FREE_DAILY_LIMIT, MEDIA_CACHE_DAYS
 from logger import LOGGER
 
 logger = LOGGER(__name__)
 
+# Field projections: hot paths never pull the session string or word lists
+SETTINGS_PROJECTION = {'_id': 0, 'session': 0, 'delete_words': 0, 'replace_words': 0}
+
+# replace_words targets are stored as field names, where '.' and '$' are not
+# allowed; '%' is escaped too so the mapping stays reversible
+_KEY_ESCAPES = {'%': '%25', '.': '%2E', '$': '%24'}
+_KEY_UNESCAPES = {v: k for k, v in _KEY_ESCAPES.items()}
+# A key older versions stored as is: '.', '$' or a '%' that doesn't start an escape
+_RAW_KEY = re.compile(r'[.$]|%(?!25|2E|24)')
+
+
+def _escape_key(key):
+    return re.sub(r'[%.$]', lambda m: _KEY_ESCAPES[m.group(0)], key)
+
+
+def _unescape_key(key):
+    return re.sub(r'%(?:25|2E|24)', lambda m: _KEY_UNESCAPES[m.group(0)], key)
+
 class Database:
     
     def __init__(self, uri, database_name):
         self._client = motor.motor_asyncio.AsyncIOMotorClient(uri)
         self.db = self._client[database_name]
         self.col = self.db.users
+        self.broadcasts = self.db.broadcasts
+        self.media_cache = self.db.media_cache
+        self.jobs = self.db.jobs
+        self.workers = self.db.workers
+        self.migrations = self.db.migrations
+
+        # Per-user document cache (read-through, write-through, TTL + LRU)
+        self._cache = OrderedDict()   # id -> (loaded_at, user_doc)
+        self._cache_gen = 0           # Bumped on invalidation so in-flight loads don't store stale docs
+        self.cache_ttl = USER_CACHE_TTL
+        self.cache_size = USER_CACHE_SIZE
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    # --------------------------------------------------------
+    # Indexes & Query Plans
+    # --------------------------------------------------------
+
+    async def ensure_indexes(self):
+        """
+        Creates the indexes the bot relies on. Safe to call on every start.
+        """
+        try:
+            await self.col.create_index('id', unique=True, name='id_unique')
+        except OperationFailure as e:
+            # Usually duplicate ids left over from before the index existed
+            logger.error(f"Unique index on users.id failed, using a plain index instead: {e}")
+            await self.col.create_index('id', name='id_lookup')
+        await self.col.create_index(
+            [('is_premium', 1), ('premium_expiry', 1)],
+            name='premium_partial',
+            partialFilterExpression={'is_premium': True}
+        )
+        await self.broadcasts.create_index('state', name='state')
+        await self.media_cache.create_index('file_unique_id', name='file_unique_id')
+        await self.jobs.create_index([('state', 1), ('lease_until', 1)], name='claimable')
+        await self.jobs.create_index('user_id', name='user_id')
+        ttl = MEDIA_CACHE_DAYS * 86400
+        try:
+            await self.media_cache.create_index('created_at', name='created_ttl', expireAfterSeconds=ttl)
+        except OperationFailure:
+            # MEDIA_CACHE_DAYS changed since the index was built
+            await self.db.command('collMod', 'media_cache', index={'name': 'created_ttl', 'expireAfterSeconds': ttl})
+        logger.info("MongoDB indexes ensured")
+
+    async def check_query_plans(self):
+        """
+        Explains the hot queries and warns if any falls back to a COLLSCAN.
+        """
+        queries = {
+            'users by id': {'id': 0},
+            'premium users': {'is_premium': True},
+        }
+        for label, query in queries.items():
+            try:
+                plan = await self.col.find(query).explain()
+            except Exception as e:
+                logger.warning(f"Could not explain '{label}' query: {e}")
+                continue
+            if _has_stage(plan.get('queryPlanner', {}).get('winningPlan', {}), 'COLLSCAN'):
+                logger.warning(f"Query '{label}' {query} uses a COLLSCAN, check the users indexes")
+
+    # --------------------------------------------------------
+    # User Document Cache
+    # --------------------------------------------------------
+
+    async def get_user(self, id):
+        """
+        Returns the user's settings document (no session or word lists),
+        served from cache when fresh. Returns None if the user does not exist.
+        """
+        id = int(id)
+        entry = self._cache.get(id)
+        if entry and time.monotonic() - entry[0] < self.cache_ttl:
+            self._cache.move_to_end(id)
+            self.cache_hits += 1
+            return entry[1]
+
+        self.cache_misses += 1
+        gen = self._cache_gen
+        user = await self.col.find_one({'id': id}, SETTINGS_PROJECTION)
+        if user is not None and gen == self._cache_gen:
+            self._cache[id] = (time.monotonic(), user)
+            self._cache.move_to_end(id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return user
+
+    def _cache_set(self, id, fields):
+        # Write-through for plain $set updates; the generation bump keeps a
+        # read already in flight from caching the document from before the write
+        self._cache_gen += 1
+        entry = self._cache.get(int(id))
+        if entry:
+            entry[1].update(fields)
+
+    def _cache_unset(self, id, *keys):
+        self._cache_gen += 1
+        entry = self._cache.get(int(id))
+        if entry:
+            for key in keys:
+                entry[1].pop(key, None)
+
+    def _invalidate(self, id):
+        self._cache_gen += 1
+        self._cache.pop(int(id), None)
+
+    def forget_user(self, id):
+        """Drops the user's cached document, so the next get_user() reads MongoDB."""
+        self._invalidate(id)
+
+    def cache_stats(self):
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'size': len(self._cache),
+            'hit_rate': round(self.cache_hits / lookups, 3) if lookups else 0.0
+        }
 
     def new_user(self, id, name):
         return dict(
@@ -24,51 +167,88 @@ class Database:
     async def add_user(self, id, name):
         user = self.new_user(id, name)
         await self.col.insert_one(user)
+        self._invalidate(id)
         logger.info(f"New user added to DB: {id} - {name}")
     
     async def is_user_exist(self, id):
-        user = await self.col.find_one({'id':int(id)})
+        user = await self.get_user(id)
         return bool(user)
     
     async def total_users_count(self):
         count = await self.col.count_documents({})
         return count
 
-    async def get_all_users(self):
-        return self.col.find({})
+    async def get_all_users(self, projection=None, premium=None, banned=None, since=None, batch_size=None):
+        """
+        Cursor over the users matching the filters (None = either way). `since`
+        is a UTC datetime compared with the join time stored in the _id.
+        """
+        query = {}
+        if premium is not None:
+            query['is_premium'] = True if premium else {'$ne': True}
+        if banned is not None:
+            query['is_banned'] = True if banned else {'$ne': True}
+        if since is not None:
+            query['_id'] = {'$gte': ObjectId.from_datetime(since)}
+        cursor = self.col.find(query, projection)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        return cursor
 
     async def delete_user(self, user_id):
         await self.col.delete_many({'id': int(user_id)})
+        self._invalidate(user_id)
         logger.info(f"User deleted from DB: {user_id}")
 
+    async def delete_users(self, user_ids):
+        """Removes many users in one delete_many (e.g. dead broadcast targets)."""
+        ids = [int(i) for i in user_ids]
+        result = await self.col.delete_many({'id': {'$in': ids}})
+        for user_id in ids:
+            self._invalidate(user_id)
+        logger.info(f"Deleted {result.deleted_count} users from DB")
+
+    async def get_users_after(self, cursor, limit):
+        """
+        Returns the next `limit` users ordered by _id, starting after `cursor`
+        (None = from the beginning). Used for resumable iteration.
+        """
+        query = {'_id': {'$gt': cursor}} if cursor is not None else {}
+        users = self.col.find(query, {'_id': 1, 'id': 1}).sort('_id', 1).limit(limit)
+        return await users.to_list(length=limit)
+
     async def set_session(self, id, session):
         await self.col.update_one({'id': int(id)}, {'$set': {'session': session}})
 
     async def get_session(self, id):
-        user = await self.col.find_one({'id': int(id)})
+        user = await self.col.find_one({'id': int(id)}, {'_id': 0, 'session': 1}) or {}
         return user.get('session')
 
     # Caption Support
     async def set_caption(self, id, caption):
         await self.col.update_one({'id': int(id)}, {'$set': {'caption': caption}})
+        self._cache_set(id, {'caption': caption})
 
     async def get_caption(self, id):
-        user = await self.col.find_one({'id': int(id)})
+        user = await self.get_user(id) or {}
         return user.get('caption', None)
 
     async def del_caption(self, id):
         await self.col.update_one({'id': int(id)}, {'$unset': {'caption': ""}})
+        self._cache_unset(id, 'caption')
 
     # Thumbnail Support
     async def set_thumbnail(self, id, thumbnail):
         await self.col.update_one({'id': int(id)}, {'$set': {'thumbnail': thumbnail}})
+        self._cache_set(id, {'thumbnail': thumbnail})
 
     async def get_thumbnail(self, id):
-        user = await self.col.find_one({'id': int(id)})
+        user = await self.get_user(id) or {}
         return user.get('thumbnail', None)
 
     async def del_thumbnail(self, id):
         await self.col.update_one({'id': int(id)}, {'$unset': {'thumbnail': ""}})
+        self._cache_unset(id, 'thumbnail')
 
     # Rexbots / Modified by You
     # Don't Remove Credit
@@ -77,88 +257,134 @@ class Database:
     # Premium Support
     async def add_premium(self, id, expiry_date):
         # When user buys premium, we also reset their limits just in case
-        await self.col.update_one({'id': int(id)}, {
-            '$set': {
-                'is_premium': True, 
-                'premium_expiry': expiry_date,
-                'daily_usage': 0,
-                'limit_reset_time': None
-            }
-        })
+        fields = {
+            'is_premium': True, 
+            'premium_expiry': expiry_date,
+            'daily_usage': 0,
+            'limit_reset_time': None
+        }
+        await self.col.update_one({'id': int(id)}, {'$set': fields})
+        self._cache_set(id, fields)
         logger.info(f"User {id} granted premium until {expiry_date}")
 
     async def remove_premium(self, id):
         await self.col.update_one({'id': int(id)}, {'$set': {'is_premium': False, 'premium_expiry': None}})
+        self._cache_set(id, {'is_premium': False, 'premium_expiry': None})
         logger.info(f"User {id} removed from premium")
 
     async def check_premium(self, id):
-        user = await self.col.find_one({'id': int(id)})
+        user = await self.get_user(id)
         if user and user.get('is_premium'):
             return user.get('premium_expiry')
         return None
 
-    async def get_premium_users(self):
-        return self.col.find({'is_premium': True})
+    async def get_premium_users(self, projection=None):
+        return self.col.find({'is_premium': True}, projection)
 
     # Ban Support
     async def ban_user(self, id):
         await self.col.update_one({'id': int(id)}, {'$set': {'is_banned': True}})
+        self._cache_set(id, {'is_banned': True})
         logger.warning(f"User banned: {id}")
 
     async def unban_user(self, id):
         await self.col.update_one({'id': int(id)}, {'$set': {'is_banned': False}})
+        self._cache_set(id, {'is_banned': False})
         logger.info(f"User unbanned: {id}")
 
     async def is_banned(self, id):
-        user = await self.col.find_one({'id': int(id)})
+        user = await self.get_user(id) or {}
         return user.get('is_banned', False)
 
     # Dump Chat Support
     async def set_dump_chat(self, id, chat_id):
+        if chat_id is None:
+            await self.col.update_one({'id': int(id)}, {'$unset': {'dump_chat': ""}})
+            self._cache_unset(id, 'dump_chat')
+            return
         await self.col.update_one({'id': int(id)}, {'$set': {'dump_chat': int(chat_id)}})
+        self._cache_set(id, {'dump_chat': int(chat_id)})
 
     async def get_dump_chat(self, id):
-        user = await self.col.find_one({'id': int(id)})
+        user = await self.get_user(id) or {}
         return user.get('dump_chat', None)
 
     # Delete/Replace Words Support
+    # Every change bumps `words_version`, which tells compiled rewriters they are stale
     async def set_delete_words(self, id, words):
-        await self.col.update_one({'id': int(id)}, {'$addToSet': {'delete_words': {'$each': words}}})
+        await self.col.update_one({'id': int(id)}, {'$addToSet': {'delete_words': {'$each': words}}, '$inc': {'words_version': 1}})
+        self._invalidate(id)
 
     async def get_delete_words(self, id):
-        user = await self.col.find_one({'id': int(id)})
+        user = await self.col.find_one({'id': int(id)}, {'_id': 0, 'delete_words': 1}) or {}
         return user.get('delete_words', [])
 
     async def remove_delete_words(self, id, words):
-        await self.col.update_one({'id': int(id)}, {'$pull': {'delete_words': {'$in': words}}})
+        await self.col.update_one({'id': int(id)}, {'$pull': {'delete_words': {'$in': words}}, '$inc': {'words_version': 1}})
+        self._invalidate(id)
 
     async def set_replace_words(self, id, repl_dict):
-        user = await self.col.find_one({'id': int(id)})
-        current_repl = user.get('replace_words', {})
-        current_repl.update(repl_dict)
-        await self.col.update_one({'id': int(id)}, {'$set': {'replace_words': current_repl}})
+        # One atomic update of just the given pairs; concurrent edits don't clobber each other
+        fields = {f'replace_words.{_escape_key(target)}': repl for target, repl in repl_dict.items()}
+        await self.col.update_one({'id': int(id)}, {'$set': fields, '$inc': {'words_version': 1}})
+        self._invalidate(id)
 
     async def get_replace_words(self, id):
-        user = await self.col.find_one({'id': int(id)})
-        return user.get('replace_words', {})
+        user = await self.col.find_one({'id': int(id)}, {'_id': 0, 'replace_words': 1}) or {}
+        return {_unescape_key(k): v for k, v in user.get('replace_words', {}).items()}
 
     async def remove_replace_words(self, id, words):
-        user = await self.col.find_one({'id': int(id)})
-        current_repl = user.get('replace_words', {})
-        for w in words:
-            current_repl.pop(w, None)
-        await self.col.update_one({'id': int(id)}, {'$set': {'replace_words': current_repl}})
+        fields = {f'replace_words.{_escape_key(w)}': "" for w in words}
+        await self.col.update_one({'id': int(id)}, {'$unset': fields, '$inc': {'words_version': 1}})
+        self._invalidate(id)
+
+    async def migrate_replace_words(self):
+        """
+        One-time pass escaping the replace_words keys that older versions
+        stored raw, which dotted $set/$unset paths can't address. An escaped
+        key already present for the same target was written later and wins.
+        """
+        if await self.migrations.find_one({'_id': 'replace_words_keys'}):
+            return
+        migrated = skipped = 0
+        async for user in self.col.find({'replace_words': {'$exists': True}}, {'_id': 1, 'id': 1, 'replace_words': 1, 'words_version': 1}):
+            words = user.get('replace_words') or {}
+            raw = {k: v for k, v in words.items() if _RAW_KEY.search(k)}
+            if not raw:
+                continue
+            fixed = {_escape_key(k): v for k, v in raw.items()}
+            fixed.update({k: v for k, v in words.items() if k not in raw})
+            # Skipped if the words changed meanwhile; retried on the next start
+            result = await self.col.update_one(
+                {'_id': user['_id'], 'words_version': user.get('words_version')},
+                {'$set': {'replace_words': fixed}, '$inc': {'words_version': 1}}
+            )
+            if result.modified_count:
+                migrated += 1
+                self._invalidate(user['id'])
+            else:
+                skipped += 1
+        logger.info(f"Escaped replace_words keys of {migrated} users ({skipped} left for the next start)")
+        if skipped:
+            return
+        await self.migrations.update_one({'_id': 'replace_words_keys'}, {'$set': {'done_at': datetime.datetime.now()}}, upsert=True)
+
+    async def get_words(self, id):
+        """Delete and replace words in one round-trip."""
+        user = await self.col.find_one({'id': int(id)}, {'_id': 0, 'delete_words': 1, 'replace_words': 1}) or {}
+        replace_words = {_unescape_key(k): v for k, v in user.get('replace_words', {}).items()}
+        return user.get('delete_words', []), replace_words
 
     # --------------------------------------------------------
     # NEW FEATURES: Daily Limits (Free User Restriction)
     # --------------------------------------------------------
 
-    async def check_limit(self, id):
+    async def check_limit(self, id, limit=FREE_DAILY_LIMIT):
         """
-        Checks if a user has hit their daily limit.
+        Checks if a user has hit their daily limit (read-only).
         Returns: True if BLOCKED (limit reached), False if ALLOWED.
         """
-        user = await self.col.find_one({'id': int(id)})
+        user = await self.get_user(id)
         if not user:
             return False # Should be added via add_user, but safe fallback
         
@@ -166,51 +392,305 @@ class Database:
         if user.get('is_premium'):
             return False 
 
-        # 2. Check Time Reset
-        now = datetime.datetime.now()
+        # 2. Expired or never started window: count is effectively 0
         reset_time = user.get('limit_reset_time')
-        
-        # If reset time has passed or was never set, reset count to 0
-        if reset_time is None or now >= reset_time:
-            await self.col.update_one(
-                {'id': int(id)}, 
-                {'$set': {'daily_usage': 0, 'limit_reset_time': None}}
-            )
-            return False # Allowed (count is 0)
+        if reset_time is None or datetime.datetime.now() >= reset_time:
+            return False
 
         # 3. Check Count
-        usage = user.get('daily_usage', 0)
-        if usage >= 10:
-            return True # Blocked
-        
-        return False # Allowed
+        return user.get('daily_usage', 0) >= limit
+
+    async def consume_quota(self, id, units=1, limit=FREE_DAILY_LIMIT):
+        """
+        Atomically reserves up to `units` saves from the daily quota in a
+        single find_one_and_update, resetting an expired 24h window in the
+        same operation (the timer starts with the first save of a cycle).
+        Returns (granted, remaining). remaining is None for unlimited users.
+        """
+        # A negative count would lower daily_usage through the $min below
+        units = max(0, int(units))
+        if await self.check_premium(id):
+            return units, None
+
+        now = datetime.datetime.now()
+        expired = {'$or': [
+            {'$eq': [{'$ifNull': ['$limit_reset_time', None]}, None]},
+            {'$lte': ['$limit_reset_time', now]}
+        ]}
+        base = {'$cond': [expired, 0, {'$ifNull': ['$daily_usage', 0]}]}
+        granted_expr = {'$min': [units, {'$max': [0, {'$subtract': [limit, base]}]}]}
+        before = await self.col.find_one_and_update(
+            {'id': int(id), 'is_premium': {'$ne': True}},
+            [{'$set': {
+                'daily_usage': {'$add': [base, granted_expr]},
+                'limit_reset_time': {'$cond': [expired, now + datetime.timedelta(hours=24), '$limit_reset_time']}
+            }}],
+            projection={'_id': 0, 'daily_usage': 1, 'limit_reset_time': 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is None:
+            # Premium (granted since the cache was filled) or not registered yet
+            return units, None
+
+        # Mirror the server-side arithmetic, both sides used the same `now`
+        reset_time = before.get('limit_reset_time')
+        window_expired = reset_time is None or now >= reset_time
+        used = 0 if window_expired else before.get('daily_usage', 0)
+        granted = min(units, max(0, limit - used))
+        self._cache_set(id, {
+            'daily_usage': used + granted,
+            'limit_reset_time': now + datetime.timedelta(hours=24) if window_expired else reset_time
+        })
+        return granted, limit - used - granted
+
+    async def refund_quota(self, id, units):
+        """
+        Gives back reserved-but-unused saves (e.g. cancelled or empty messages).
+        """
+        if units <= 0:
+            return
+        result = await self.col.update_one(
+            {'id': int(id), 'is_premium': {'$ne': True}, 'daily_usage': {'$gte': units}},
+            {'$inc': {'daily_usage': -units}}
+        )
+        if result.modified_count:
+            self._invalidate(id)
 
     async def add_traffic(self, id):
         """
-        Increments usage count. 
+        Consumes one save from the daily quota.
         If it's the first save of the cycle, sets the 24h timer.
         """
-        user = await self.col.find_one({'id': int(id)})
-        
-        # If premium, do nothing or track stats if you want (currently strictly for limit logic)
-        if user.get('is_premium'):
-            return
+        await self.consume_quota(id, 1)
 
-        now = datetime.datetime.now()
-        reset_time = user.get('limit_reset_time')
+    # --------------------------------------------------------
+    # Broadcast Jobs (resumable)
+    # --------------------------------------------------------
 
-        # Logic: If timer is not running (None), start it for 24 hours from NOW.
-        if reset_time is None:
-            new_reset_time = now + datetime.timedelta(hours=24)
-            await self.col.update_one(
-                {'id': int(id)}, 
-                {'$set': {'daily_usage': 1, 'limit_reset_time': new_reset_time}}
-            )
-        else:
-            # Just increment
-            await self.col.update_one(
-                {'id': int(id)}, 
-                {'$inc': {'daily_usage': 1}}
+    async def create_broadcast(self, from_chat_id, message_id, status_chat_id, status_message_id, total):
+        job = dict(
+            from_chat_id = from_chat_id,
+            message_id = message_id,
+            status_chat_id = status_chat_id,
+            status_message_id = status_message_id,
+            total = total,
+            cursor = None,              # Last users._id fully processed
+            counters = {},
+            state = "running",
+            created_at = datetime.datetime.now()
+        )
+        result = await self.broadcasts.insert_one(job)
+        job['_id'] = result.inserted_id
+        return job
+
+    async def get_running_broadcasts(self):
+        return self.broadcasts.find({'state': "running"}).sort('_id', 1)
+
+    async def update_broadcast(self, job_id, cursor, counters):
+        """Checkpoints a running job. Returns False if it is no longer running."""
+        result = await self.broadcasts.update_one(
+            {'_id': job_id, 'state': "running"},
+            {'$set': {'cursor': cursor, 'counters': counters, 'updated_at': datetime.datetime.now()}}
+        )
+        return bool(result.matched_count)
+
+    async def finish_broadcast(self, job_id, state, counters):
+        await self.broadcasts.update_one(
+            {'_id': job_id},
+            {'$set': {'state': state, 'counters': counters, 'finished_at': datetime.datetime.now()}}
+        )
+
+    async def cancel_broadcasts(self, job_id=None):
+        query = {'state': "running"}
+        if job_id is not None:
+            query['_id'] = job_id
+        result = await self.broadcasts.update_many(query, {'$set': {'state': "cancelled"}})
+        return result.modified_count
+
+    # --------------------------------------------------------
+    # Media Cache (cross-user file_id dedup)
+    # --------------------------------------------------------
+
+    async def get_cached_media(self, file_unique_id, file_name):
+        # The uploaded file name is part of the file_id and may carry another user's word rewrites
+        return await self.media_cache.find_one({'file_unique_id': file_unique_id, 'file_name': file_name}, {'_id': 0, 'file_id': 1})
+
+    async def cache_media(self, chat_id, message_id, file_unique_id, file_id, msg_type, file_name):
+        """
+        Stores the bot's file_id for a source post, uploaded as `file_name`. Keyed
+        by (chat, message) so an edited post replaces its entry; created_at
+        drives the TTL eviction.
+        """
+        await self.media_cache.update_one(
+            {'_id': f"{chat_id}:{message_id}"},
+            {'$set': {
+                'file_unique_id': file_unique_id,
+                'file_id': file_id,
+                'msg_type': msg_type,
+                'file_name': file_name,
+                'created_at': datetime.datetime.now(datetime.timezone.utc)
+            }},
+            upsert=True
+        )
+
+    async def drop_cached_media(self, file_unique_id):
+        await self.media_cache.delete_many({'file_unique_id': file_unique_id})
+
+    # --------------------------------------------------------
+    # Save Jobs (leased, resumable)
+    # --------------------------------------------------------
+
+    async def create_job(self, user_id, chat_id, message_id, chat_target, public, from_id, to_id, quota_granted):
+        job = dict(
+            user_id = user_id,
+            chat_id = chat_id,                # Where the user asked, results go there
+            message_id = message_id,          # The user's link message
+            chat_target = chat_target,
+            public = public,                  # Try copy_message before the user client
+            from_id = from_id,
+            to_id = to_id,
+            quota_granted = quota_granted,    # None = unlimited (premium)
+            quota_used = 0,
+            last_done = from_id - 1,          # Every id up to here is finished
+            status = {},                      # str(msg id) -> "done" / "failed"
+            state = "queued",
+            lease_owner = None,
+            lease_until = datetime.datetime.fromtimestamp(0, datetime.timezone.utc),
+            created_at = datetime.datetime.now(datetime.timezone.utc)
+        )
+        result = await self.jobs.insert_one(job)
+        job['_id'] = result.inserted_id
+        return job
+
+    async def claim_job(self, owner, lease_seconds, job_id=None, exclude_users=()):
+        """
+        Atomically leases the oldest queued job, or a running one whose lease
+        expired (its worker died). Returns the claimed job or None.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        query = {'state': {'$in': ["queued", "running"]}, 'lease_until': {'$lt': now}}
+        if job_id is not None:
+            query['_id'] = job_id
+        if exclude_users:
+            query['user_id'] = {'$nin': list(exclude_users)}
+        return await self.jobs.find_one_and_update(
+            query,
+            {'$set': {
+                'state': "running",
+                'lease_owner': owner,
+                'lease_until': now + datetime.timedelta(seconds=lease_seconds)
+            }},
+            sort=[('created_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def get_job(self, job_id):
+        return await self.jobs.find_one({'_id': job_id}, {'status': 0})
+
+    async def renew_lease(self, job_id, owner, lease_seconds):
+        """Extends a held lease. Returns False if the job was taken over or cancelled."""
+        result = await self.jobs.update_one(
+            {'_id': job_id, 'lease_owner': owner, 'state': "running"},
+            {'$set': {'lease_until': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=lease_seconds)}}
+        )
+        return bool(result.matched_count)
+
+    async def checkpoint_job(self, job_id, owner, statuses, last_done, quota_used):
+        """Records message outcomes and the resume point. Returns False if the lease is lost."""
+        update = {f'status.{msgid}': status for msgid, status in statuses.items()}
+        update['quota_used'] = quota_used
+        update['updated_at'] = datetime.datetime.now(datetime.timezone.utc)
+        result = await self.jobs.update_one(
+            {'_id': job_id, 'lease_owner': owner, 'state': "running"},
+            {'$set': update, '$max': {'last_done': last_done}}
+        )
+        return bool(result.matched_count)
+
+    async def release_job(self, job_id, owner):
+        """Gives a lease back without finishing the job, so it can be claimed again."""
+        await self.jobs.update_one(
+            {'_id': job_id, 'lease_owner': owner},
+            {'$set': {'lease_owner': None, 'lease_until': datetime.datetime.fromtimestamp(0, datetime.timezone.utc)}}
+        )
+
+    async def finish_job(self, job_id, owner, state):
+        await self.jobs.update_one(
+            {'_id': job_id, 'lease_owner': owner},
+            {'$set': {'state': state, 'lease_owner': None, 'finished_at': datetime.datetime.now(datetime.timezone.utc)}}
+        )
+
+    async def has_active_job(self, user_id):
+        return bool(await self.jobs.find_one({'user_id': user_id, 'state': {'$in': ["queued", "running"]}}, {'_id': 1}))
+
+    async def cancel_jobs(self, user_id):
+        """
+        Cancels the user's unfinished jobs. Jobs no live worker holds (queued,
+        or orphaned by a dead worker) get their unused quota back here; a
+        running job refunds itself when it notices the cancel.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        cancelled = 0
+        while True:
+            # One job at a time, so a job is refunded by whoever moved it out of queued/running
+            job = await self.jobs.find_one_and_update(
+                {'user_id': user_id, 'state': {'$in': ["queued", "running"]}, 'lease_until': {'$lt': now}},
+                {'$set': {'state': "cancelled", 'lease_owner': None, 'finished_at': now}},
+                projection={'quota_granted': 1, 'quota_used': 1}
             )
+            if job is None:
+                break
+            cancelled += 1
+            await self.refund_quota(user_id, (job.get('quota_granted') or 0) - job.get('quota_used', 0))
+        result = await self.jobs.update_many(
+            {'user_id': user_id, 'state': {'$in': ["queued", "running"]}},
+            {'$set': {'state': "cancelled"}}
+        )
+        return cancelled + result.modified_count
+
+    # --------------------------------------------------------
+    # Worker Heartbeats
+    # --------------------------------------------------------
+
+    async def beat_worker(self, worker_id, running):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        await self.workers.update_one(
+            {'_id': worker_id},
+            {'$set': {'heartbeat_at': now, 'running': running}, '$setOnInsert': {'started_at': now}},
+            upsert=True
+        )
+
+    async def remove_worker(self, worker_id):
+        """Deregisters a worker and frees its leases so its jobs resume right away."""
+        await self.workers.delete_one({'_id': worker_id})
+        await self._release_owner_jobs([worker_id])
+
+    async def reap_dead_workers(self, stale_after):
+        """Frees the leases of workers whose heartbeat is older than `stale_after` seconds."""
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=stale_after)
+        dead = [w['_id'] async for w in self.workers.find({'heartbeat_at': {'$lt': cutoff}}, {'_id': 1})]
+        if not dead:
+            return 0
+        await self.workers.delete_many({'_id': {'$in': dead}})
+        await self._release_owner_jobs(dead)
+        logger.warning(f"Reaped dead workers: {', '.join(dead)}")
+        return len(dead)
+
+    async def get_workers(self):
+        return self.workers.find({}).sort('started_at', 1)
+
+    async def _release_owner_jobs(self, owners):
+        await self.jobs.update_many(
+            {'lease_owner': {'$in': owners}, 'state': "running"},
+            {'$set': {'lease_owner': None, 'lease_until': datetime.datetime.fromtimestamp(0, datetime.timezone.utc)}}
+        )
+
+def _has_stage(plan, stage):
+    # Walks an explain() plan tree looking for the given stage name
+    if not isinstance(plan, dict):
+        return False
+    if plan.get('stage') == stage:
+        return True
+    children = [plan.get('inputStage')] + plan.get('inputStages', []) + [plan.get('queryPlan')]
+    return any(_has_stage(child, stage) for child in children if child)
 
 db = Database(DB_URI, DB_NAME)
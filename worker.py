@@ -0,0 +1,120 @@
+# Rexbots
+# Don't Remove Credit
+# Telegram Channel @RexBots_Official
+
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from pyrogram import Client
+
+from config import API_ID, API_HASH, BOT_TOKEN, WORKERS
+from database.db import db
+from logger import LOGGER
+from Rexbots.client_pool import user_pool
+from Rexbots.jobs import WorkerHeartbeat, WORKER_ID
+from Rexbots.ratelimit import LimitedInvoke
+from Rexbots.start import resume_jobs, stop_jobs, batch_temp
+from Rexbots.staging import staging
+
+logger = LOGGER(__name__)
+
+# ==============================================================================
+# 🏭 SAVE WORKER
+# Runs save jobs from the shared MongoDB queue in a separate process, with its
+# own event loop and user-client pool. The bot process (WORKER_MODE=True) only
+# handles updates and enqueues jobs.
+#
+#   python3 worker.py              # launcher: starts WORKERS processes
+#   python3 worker.py --workers 4  # launcher with an explicit count
+#   python3 worker.py --single 0   # one worker (what the launcher spawns)
+# ==============================================================================
+RESTART_DELAY = 5  # Seconds before the launcher restarts a crashed worker
+CACHE_TTL = 15     # Seconds a worker trusts a cached user document; settings are edited in the bot process
+
+
+class Worker(LimitedInvoke, Client):
+    def __init__(self, index):
+        super().__init__(
+            name=f"Rexbots_Worker_{index}",
+            api_id=API_ID,
+            api_hash=API_HASH,
+            bot_token=BOT_TOKEN,
+            no_updates=True,                    # The bot process owns update handling
+            in_memory=True,
+            sleep_threshold=15,                 # Auto-sleep on FloodWait (raised to bot_limiter on its calls)
+            max_concurrent_transmissions=10,
+            ipv6=False,
+        )
+        self.heartbeat = WorkerHeartbeat(running=lambda: len(batch_temp.TASKS))
+        self.job_poller = None
+
+    async def start(self):
+        await super().start()
+        # The bot's write-through never reaches this process's cache
+        db.cache_ttl = min(db.cache_ttl, CACHE_TTL)
+        # Only directories of dead processes go, other workers keep staging
+        staging.sweep()
+        self.heartbeat.start()
+        self.job_poller = asyncio.create_task(resume_jobs(self))
+        logger.info(f"Worker {WORKER_ID} running")
+
+    async def stop(self, *args):
+        if self.job_poller:
+            self.job_poller.cancel()
+        # Hand running jobs back so other workers resume them immediately
+        await stop_jobs()
+        await self.heartbeat.stop()
+        await user_pool.close_all()
+        await super().stop()
+        logger.info(f"Worker {WORKER_ID} stopped")
+
+
+def launch(count):
+    """Starts `count` worker processes and restarts any that exit until stopped."""
+    procs = {}
+    stopping = False
+    # Workers split the limits across all users by the number actually running
+    os.environ["WORKERS"] = str(count)
+
+    def spawn(index):
+        procs[index] = subprocess.Popen([sys.executable, __file__, "--single", str(index)])
+        logger.info(f"Started worker {index} (pid {procs[index].pid})")
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for proc in procs.values():
+            if proc.poll() is None:
+                proc.terminate()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for index in range(count):
+        spawn(index)
+    while not stopping:
+        time.sleep(1)
+        for index, proc in list(procs.items()):
+            if proc.poll() is not None and not stopping:
+                logger.warning(f"Worker {index} exited with {proc.returncode}, restarting")
+                time.sleep(RESTART_DELAY)
+                spawn(index)
+    for proc in procs.values():
+        proc.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Save job workers")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="worker processes to launch")
+    parser.add_argument("--single", type=int, metavar="INDEX", help="run one worker in this process")
+    args = parser.parse_args()
+
+    if args.single is not None:
+        Worker(args.single).run()
+    else:
+        launch(args.workers)